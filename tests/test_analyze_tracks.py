@@ -0,0 +1,68 @@
+"""statistics of tracks compared with the loop of Analysis.analyze they replaced"""
+
+from collections import deque
+
+import numpy as np
+
+from zftracking.tracking.analyze_tracks import distance
+from zftracking.tracking.analyze_tracks import zone_stats
+from zftracking.tracking.smoothing import adaptive
+from zftracking.tracking.track_store import TrackStore
+
+
+def loop_totals(tracks):
+    """frames and distance of the tracks as the removed loop of Analysis.analyze counted them"""
+    frames = 0
+    dist = 0
+    for track in tracks:
+        prev_pt = False
+        frames_on_track = 0
+        for pt in track:
+            if not prev_pt:
+                prev_pt = pt
+                frames_on_track += 1
+                continue
+            frames_on_track += pt.frame - prev_pt.frame
+            prev_pt = pt
+        frames += frames_on_track
+        pts = deque(maxlen=2)
+        for pt in adaptive(track.coords):
+            if len(pts) == 2:
+                dist += distance(pts)
+            pts.append(pt)
+    return frames, dist
+
+
+def random_wells(rng, wells):
+    """outer and inner tracks of every well, with gaps between their frames
+    and lengths around the blocks of the adaptive smoothing"""
+    zones = []
+    for _ in range(wells):
+        zones.append([])
+        for _ in range(2):
+            tracks = []
+            for _ in range(int(rng.integers(0, 4))):
+                n = int(rng.integers(1, 45))
+                frames = int(rng.integers(0, 1000)) + np.cumsum(rng.integers(1, 4, n))
+                coords = 100 + np.cumsum(rng.integers(-3, 4, (n, 2)), axis=0)
+                tracks.append(TrackStore(frame=frames, x=coords[:, 0], y=coords[:, 1]))
+            zones[-1].append(tracks)
+    return zones
+
+
+def test_zone_stats_matches_loop():
+    zones = random_wells(np.random.default_rng(0), 100)
+    stats = zone_stats(zones, fps=30, px_size=0.006)[0]
+    for idx, (outer, inner) in enumerate(zones):
+        frames_outer, distance_outer = loop_totals(outer)
+        frames_inner, distance_inner = loop_totals(inner)
+        expected = (frames_outer / 30, distance_outer * 0.006, frames_inner / 30, distance_inner * 0.006)
+        found = tuple(stats[idx][name] for name in ('time_outer', 'distance_outer', 'time_inner', 'distance_inner'))
+        np.testing.assert_allclose(found, expected, rtol=1e-12, atol=0)
+
+
+def test_still_larva_keeps_time_percentage():
+    track = TrackStore(frame=np.arange(20), x=np.full(20, 5), y=np.full(20, 5))
+    stats = zone_stats([([track], [])])[0]
+    assert stats['outer_time_percentage'][0] == 100
+    assert np.isnan(stats['outer_distance_percentage'][0])
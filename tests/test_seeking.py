@@ -0,0 +1,73 @@
+"""frame accurate seeking with the FrameIndex, needs ffmpeg"""
+
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+from zftracking.external.runffmpeg import Ffmpeg
+from zftracking.external.runffmpeg import FfmpegReader
+from zftracking.external.runffmpeg import FrameIndex
+
+FFMPEG = Ffmpeg("").ffmpeg_location
+
+pytestmark = pytest.mark.skipif(shutil.which(FFMPEG) is None, reason="needs ffmpeg")
+
+# closed groups of pictures with B-frames, so packets are stored out of presentation order
+CLOSED_GOP = ["-g", "12", "-bf", "2", "-flags", "+cgop", "-sc_threshold", "1000000000", "-q:v", "2"]
+VIDEOS = {
+    # Matroska keeps the start time of the stream
+    "start_time.mkv": ["-output_ts_offset", "10", "-c:v", "mpeg2video"] + CLOSED_GOP,
+    # AVI stores no presentation timestamps for H.264
+    "h264.avi": ["-c:v", "libx264", "-g", "12"],
+    # and only some for MPEG-4 with B-frames
+    "mpeg4.avi": ["-c:v", "mpeg4"] + CLOSED_GOP,
+}
+
+
+@pytest.fixture(params=sorted(VIDEOS))
+def video(request, tmp_path):
+    """a short test video written by ffmpeg"""
+    path = str(tmp_path / request.param)
+    subprocess.run([FFMPEG, "-hide_banner", "-loglevel", "error", "-f", "lavfi",
+                    "-i", "testsrc=duration=4:size=160x120:rate=25"] + VIDEOS[request.param] + [path], check=True)
+    return path
+
+
+def test_index_has_every_frame(video):
+    index = FrameIndex(video)
+    frames = [frame.copy() for frame in FfmpegReader(video)]
+    assert index.nframes == len(frames) == 100
+    assert index.keyframes[0]
+
+
+@pytest.mark.parametrize("frame", [1, 11, 12, 13, 50, 99])
+def test_seek_to_frame(video, frame):
+    frames = [f.copy() for f in FfmpegReader(video)]
+    part = [f.copy() for f in FfmpegReader(video, start=frame, end=frame + 1)]
+    assert len(part) == 1
+    assert np.array_equal(part[0], frames[frame])
+
+
+@pytest.mark.parametrize("prefetch", [0, 4])
+def test_first_group_of_pictures(video, prefetch):
+    frames = [f.copy() for f in FfmpegReader(video)]
+    part = [f.copy() for f in FfmpegReader(video, prefetch=prefetch, start=2, end=14)]
+    assert len(part) == 12
+    assert all(np.array_equal(a, b) for a, b in zip(part, frames[2:14]))
+
+
+def test_seek_keyframe(video, tmp_path):
+    # the video is shorter than 150 s, so the keyframe before its middle is written
+    thumb = str(tmp_path / "thumb.pgm")
+    ffmpeg = Ffmpeg(video, thumb)
+    ffmpeg.pix_fmt = "gray8"
+    ffmpeg.vframes = "1"
+    ffmpeg.seek_keyframe(150)
+    assert ffmpeg.run().returncode == 0
+    key = ffmpeg.index.keyframe(50)
+    assert 0 < key <= 50
+    frames = [f.copy() for f in FfmpegReader(video)]
+    with open(thumb, "rb") as f:
+        assert np.array_equal(np.frombuffer(f.read()[-160 * 120:], np.uint8).reshape(120, 160), frames[key])
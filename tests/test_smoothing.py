@@ -0,0 +1,61 @@
+"""smoothing filters, adaptive compared with the smooth_track loop it replaced"""
+
+from collections import deque
+
+import numpy as np
+import pytest
+
+from zftracking.tracking.analyze_tracks import distance
+from zftracking.tracking.smoothing import adaptive
+from zftracking.tracking.smoothing import rolling_mean
+from zftracking.tracking.smoothing import rolling_median
+
+
+def smooth_track(coords, method):
+    """the removed loop, blocks of 10 points moving less than 10 pixels are replaced by one point"""
+    wd = deque(maxlen=10)
+    smoothed_track = []
+    for pt in coords:
+        if len(wd) == 10:
+            d_pts = deque(maxlen=2)
+            dist = 0
+            for d_pt in wd:
+                if len(d_pts) == 2:
+                    dist += distance(d_pts)
+                d_pts.append(d_pt)
+            if dist < 10:
+                smoothed_track.append(method(wd))
+            else:
+                smoothed_track += list(wd)
+            wd.clear()
+        wd.append(pt)
+    if 10 >= len(wd) > 0:
+        smoothed_track.append(method(wd))
+    return smoothed_track
+
+
+def mean(pts):
+    return tuple(int(np.mean(i)) for i in zip(*pts))
+
+
+def median(pts):
+    return tuple(int(np.median(i)) for i in zip(*pts))
+
+
+@pytest.mark.parametrize("method", [mean, median])
+def test_adaptive_matches_loop(method):
+    rng = np.random.default_rng(0)
+    for _ in range(500):
+        # random walks in whole pixels, some still and some fast, with lengths around the block boundaries
+        n = int(rng.integers(1, 45))
+        steps = rng.integers(-int(rng.integers(1, 4)), int(rng.integers(1, 4)) + 1, (n, 2))
+        coords = [tuple(int(v) for v in pt) for pt in 100 + np.cumsum(steps, axis=0)]
+        expected = np.array(smooth_track(coords, method), np.float64).reshape(-1, 2)
+        smoothed = adaptive(np.array(coords), median=method is median)
+        np.testing.assert_array_equal(smoothed, expected)
+
+
+def test_rolling_filters_of_short_tracks():
+    coords = np.array([[0, 0], [2, 4], [4, 2]])
+    np.testing.assert_array_equal(rolling_mean(coords, 10), [[2, 2]])
+    np.testing.assert_array_equal(rolling_median(coords, 10), [[2, 2]])
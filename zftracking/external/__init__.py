@@ -1 +1 @@
-__all__ = ['runffmpeg', 'runfiji']
+__all__ = ['runffmpeg']
@@ -1,12 +1,23 @@
 """executes external program: ffmpeg"""
 
+import hashlib
+import queue
+import re
 import subprocess
 import os
+import tempfile
+from threading import Thread
+
+import numpy as np
+
+
+# version of ffmpeg by location, asked once per process
+VERSIONS = {}
 
 
 class Ffmpeg:
     """class for ffmpeg execution"""
-    def __init__(self, infile, outfile):
+    def __init__(self, infile, outfile=None):
         self.ffmpeg_location = "ffmpeg"
         script_dir = os.path.dirname(__file__)
         rel_path = "data/ffmpeg_location.txt"
@@ -15,8 +26,11 @@ class Ffmpeg:
             for line in dat:
                 if line != '':
                     self.ffmpeg_location = line.rstrip('\n')
-        self.infile = '"' + infile + '"'
-        self.outfile = '"' + outfile + '"'
+        self.infile = infile
+        # output files with their own filter, all are written from one decoding pass
+        self.outputs = []
+        if outfile is not None:
+            self.add_output(outfile)
         self.filter = False
         self.pix_fmt = False
         self.vcodec = False
@@ -24,27 +38,454 @@ class Ffmpeg:
         self.ss = False
         self.vframes = False
         self.width = False
+        # container metadata, filled by probe
+        self.size = None
+        self.fps = None
+        self.duration = None
+        # FrameIndex of the input, used for frame accurate seeking
+        self.index = None
 
-    def run(self):
-        """prepares arguments and executes ffmpeg as a subprocess"""
-        args = self.ffmpeg_location + " -hide_banner -loglevel panic "
-        if self.ss:
-            args += '-ss ' + self.ss + " "
-        args += "-i " + self.infile + " "
-        if self.filter:
-            args += '-filter:v "' + self.filter + '" '
+    def probe(self):
+        """reads frame size, frame rate and duration of the input from the ffmpeg banner"""
+        d = subprocess.run([self.ffmpeg_location, "-hide_banner", "-i", self.infile],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        info = d.stderr.decode(errors="replace")
+        size = re.search(r"Video:.*?(\d{2,})x(\d{2,})", info)
+        if size is None:
+            raise IOError("no video stream found in " + self.infile)
+        self.size = (int(size.group(1)), int(size.group(2)))
+        # the banner shows the frame rate of the stream rounded to two decimals
+        fps = re.search(r"(\d+(?:\.\d+)?) (?:fps|tbr)", info)
+        if fps:
+            self.fps = float(fps.group(1))
+            # NTSC rates like 29.97 are exactly 30000/1001
+            ntsc = round(self.fps * 1.001)
+            if self.fps != int(self.fps) and abs(self.fps * 1.001 - ntsc) < 0.01:
+                self.fps = ntsc / 1.001
+        duration = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", info)
+        if duration:
+            h, m, s = duration.groups()
+            self.duration = int(h) * 3600 + int(m) * 60 + float(s)
+
+    def version(self):
+        """major and minor version of ffmpeg, builds from git without a version count as newest"""
+        if self.ffmpeg_location not in VERSIONS:
+            try:
+                d = subprocess.run([self.ffmpeg_location, "-version"], stdout=subprocess.PIPE,
+                                   stderr=subprocess.DEVNULL)
+                match = re.match(r"ffmpeg version n?(\d+)\.(\d+)", d.stdout.decode(errors="replace"))
+            except OSError:
+                match = None
+            VERSIONS[self.ffmpeg_location] = (int(match.group(1)), int(match.group(2))) if match else (99, 0)
+        return VERSIONS[self.ffmpeg_location]
+
+    def passthrough_args(self):
+        """output option passing every decoded frame once with its timestamp,
+        without it ffmpeg duplicates or drops frames to reach a constant frame rate"""
+        if self.version() >= (5, 1):
+            return ["-fps_mode", "passthrough"]
+        return ["-vsync", "0"]
+
+    def seek_args(self):
+        """input options seeking to ss, the time since the start of the container like the timestamps
+        of the FrameIndex, ffmpeg adds the start time of the container to it,
+        missing timestamps are generated like for the FrameIndex"""
+        if not self.ss:
+            return []
+        return ["-fflags", "+genpts", "-ss", str(self.ss)]
+
+    def set_range(self, start=None, end=None):
+        """restricts decoding to the frames from start to end (exclusive),
+        ffmpeg seeks to start so the frames before are never decoded"""
+        if start:
+            if self.index is None:
+                self.index = FrameIndex(self.infile)
+            self.ss = "%.6f" % self.index.seek_time(start)
+        if end is not None:
+            self.vframes = str(end - (start or 0))
+
+    def seek_keyframe(self, seconds):
+        """seeks to the last keyframe before the given time, it is decoded without any other frame,
+        videos shorter than that are seeked to the middle, the first keyframe is read without seeking"""
+        if self.index is None:
+            self.index = FrameIndex(self.infile)
+        frame = self.index.frame_at(seconds)
+        if frame >= self.index.nframes:
+            frame = self.index.nframes // 2
+        key = self.index.keyframe(frame)
+        self.ss = "%.6f" % self.index.timestamp(key) if key else False
+
+    def add_output(self, outfile, out_filter=None):
+        """adds an output file, out_filter is applied after the filters common to all outputs"""
+        self.outputs.append((outfile, out_filter))
+
+    def output_args(self):
+        """encoding options, applied to every output"""
+        args = []
         if self.pix_fmt:
-            args += '-pix_fmt ' + self.pix_fmt + " "
+            args += ["-pix_fmt", self.pix_fmt]
         if self.vcodec:
-            args += '-vcodec ' + self.vcodec + " "
-        if self.width:
-            args += '-vf scale=' + str(self.width) + ':-1 '
+            args += ["-vcodec", self.vcodec]
         if self.f:
-            args += '-f ' + self.f + " "
+            args += ["-f", self.f]
         if self.vframes:
-            args += '-vframes ' + self.vframes + " "
-        args += self.outfile
+            args += ["-vframes", str(self.vframes)]
+        return args
+
+    def args(self):
+        """prepares the argument list for ffmpeg"""
+        args = [self.ffmpeg_location, "-hide_banner", "-loglevel", "panic"] + self.seek_args()
+        args += ["-i", self.infile]
+        common = []
+        if self.filter:
+            common.append(self.filter)
+        if self.width:
+            common.append("scale=" + str(self.width) + ":-1")
+        if len(self.outputs) == 1:
+            outfile, out_filter = self.outputs[0]
+            filters = common + ([out_filter] if out_filter else [])
+            if filters:
+                args += ["-filter:v", ",".join(filters)]
+            args += self.output_args() + [outfile]
+        else:
+            # split the decoded frames once and filter them separately for every output
+            graph = "[0:v]" + ",".join(common + ["split=" + str(len(self.outputs))])
+            graph += "".join("[s" + str(i) + "]" for i in range(len(self.outputs)))
+            for i, (outfile, out_filter) in enumerate(self.outputs):
+                graph += ";[s" + str(i) + "]" + (out_filter or "null") + "[o" + str(i) + "]"
+            args += ["-filter_complex", graph]
+            for i, (outfile, out_filter) in enumerate(self.outputs):
+                args += ["-map", "[o" + str(i) + "]"] + self.output_args() + [outfile]
+        return args
+
+    def run(self, wait=True):
+        """executes ffmpeg as a subprocess, without wait the running process is returned"""
+        args = self.args()
         print("running ffmpeg with:")
-        print(args)
-        d = subprocess.run(args, shell=True)
+        print(" ".join(args))
+        if not wait:
+            return subprocess.Popen(args)
+        d = subprocess.run(args)
         return d
+
+
+class FfmpegReader(Ffmpeg):
+    """reads grayscale frames from the rawvideo output of ffmpeg into a preallocated buffer,
+    cropping and scaling is done by ffmpeg"""
+    def __init__(self, infile, crop=None, width=None, prefetch=0, start=None, end=None):
+        Ffmpeg.__init__(self, infile, "-")
+        # ffmpeg compliant crop string (width:height:x:y)
+        self.crop = crop
+        # width to scale the (cropped) frames to, the aspect ratio is kept
+        self.width = width
+        self.pix_fmt = "gray8"
+        self.f = "rawvideo"
+        # number of frames decoded ahead in a background thread, 0 decodes on demand
+        self.prefetch = prefetch
+        # times the decoder waited for a free buffer: tracking is the bottleneck
+        self.decoder_stalls = 0
+        # times the consumer waited for a decoded frame: decoding is the bottleneck
+        self.tracker_stalls = 0
+        # the index is built once per video and holds the metadata
+        self.index = FrameIndex(infile)
+        self.size = self.index.size
+        self.fps = self.index.fps
+        # first frame to decode and frame to stop at (exclusive)
+        self.start = start or 0
+        self.set_range(start, end)
+        # frames decoded from the start of the video and dropped before start, ffmpeg cannot seek into
+        # the first group of pictures of some AVI files and would decode the same frames after a seek
+        self.skip = 0
+        if self.start and self.index.keyframe(self.start) == 0:
+            self.skip = self.start
+            self.ss = False
+            if self.vframes:
+                self.vframes = str(int(self.vframes) + self.skip)
+
+    @property
+    def nframes(self):
+        """number of frames to decode"""
+        if self.vframes:
+            return int(self.vframes) - self.skip
+        return self.index.nframes - self.start
+
+    def out_size(self):
+        """width and height of the frames after cropping and scaling"""
+        width, height = self.size
+        if self.crop:
+            width, height = (int(v) for v in self.crop.split(':')[:2])
+        if self.width:
+            height = (self.width * height + width // 2) // width
+            width = self.width
+        return width, height
+
+    def filters(self):
+        """crop and scale filters, in that order"""
+        filters = []
+        if self.crop:
+            filters.append("crop=" + self.crop)
+        if self.width:
+            filters.append("scale=%i:%i" % self.out_size())
+        return ",".join(filters)
+
+    def args(self):
+        """argument list for reading frames from stdout, errors are written to stderr"""
+        args = [self.ffmpeg_location, "-hide_banner", "-loglevel", "error"] + self.seek_args()
+        args += ["-i", self.infile]
+        filters = self.filters()
+        if filters:
+            args += ["-filter:v", filters]
+        # every frame of the stream is read once, so the frames are numbered like in the FrameIndex
+        args += self.passthrough_args()
+        args += ["-pix_fmt", self.pix_fmt, "-f", self.f]
+        if self.vframes:
+            args += ["-vframes", self.vframes]
+        args += ["-"]
+        return args
+
+    def open(self, log):
+        """starts ffmpeg with the frames written to stdout and its errors to the log file,
+        a file instead of a pipe, so ffmpeg never blocks on errors nobody reads while decoding"""
+        return subprocess.Popen(self.args(), stdout=subprocess.PIPE, stderr=log)
+
+    def finish(self, proc, log, count):
+        """waits for ffmpeg at the end of the frames, raises an IOError with its errors
+        if it failed, gave no frame or stopped early on a decoding error"""
+        code = proc.wait()
+        log.seek(0)
+        errors = log.read().decode(errors="replace").strip()
+        # a range reaching past the end of the video is not an error
+        expected = min(self.nframes, self.index.nframes - self.start)
+        if code != 0:
+            raise IOError("ffmpeg failed with exit code %i on %s: %s" % (code, self.infile, errors))
+        if count == 0:
+            raise IOError("ffmpeg read no frame from %s: %s" % (self.infile, errors))
+        if count < expected and errors:
+            # a truncated or damaged file, ffmpeg ends with exit code 0 on most decoding errors
+            raise IOError("ffmpeg stopped after %i of %i frames of %s: %s" % (count, expected, self.infile, errors))
+
+    @staticmethod
+    def readinto(proc, frame):
+        """fills the frame with the next frame from ffmpeg, returns False at the end of the video"""
+        buffer = memoryview(frame).cast('B')
+        n = 0
+        while n < len(buffer):
+            read = proc.stdout.readinto(buffer[n:])
+            if not read:
+                # end of the video, a truncated last frame is dropped
+                return False
+            n += read
+        return True
+
+    def __iter__(self):
+        """yields the frames as 2D uint8 arrays
+
+        the yielded frame is overwritten by one of the following frames, copy frames that need to be kept"""
+        if self.prefetch > 0:
+            return self.prefetched()
+        return self.frames()
+
+    def frames(self):
+        """yields the frames decoded on demand, always filling the same buffer"""
+        width, height = self.out_size()
+        frame = np.empty((height, width), np.uint8)
+        log = tempfile.TemporaryFile()
+        proc = self.open(log)
+        count = 0
+        try:
+            while self.readinto(proc, frame):
+                count += 1
+                if count > self.skip:
+                    yield frame
+            self.finish(proc, log, max(count - self.skip, 0))
+        finally:
+            proc.kill()
+            proc.stdout.close()
+            proc.wait()
+            log.close()
+
+    def prefetched(self):
+        """yields the frames decoded ahead by a background thread into a ring of buffers"""
+        width, height = self.out_size()
+        # one buffer more than the queue depth for the frame held by the consumer
+        ring = [np.empty((height, width), np.uint8) for _ in range(self.prefetch + 1)]
+        free = queue.Queue()
+        for idx in range(len(ring)):
+            free.put(idx)
+        decoded = queue.Queue()
+        log = tempfile.TemporaryFile()
+        proc = self.open(log)
+        decoder = Thread(target=self.decode, args=(proc, ring, free, decoded), daemon=True)
+        decoder.start()
+        count = 0
+        try:
+            while True:
+                if decoded.empty():
+                    self.tracker_stalls += 1
+                idx = decoded.get()
+                if idx is None:
+                    break
+                if isinstance(idx, Exception):
+                    raise idx
+                count += 1
+                if count > self.skip:
+                    yield ring[idx]
+                free.put(idx)
+            self.finish(proc, log, max(count - self.skip, 0))
+        finally:
+            # killing ffmpeg ends a blocking read, None ends a wait for a free buffer
+            proc.kill()
+            free.put(None)
+            decoder.join()
+            proc.stdout.close()
+            proc.wait()
+            log.close()
+
+    def decode(self, proc, ring, free, decoded):
+        """reads frames from ffmpeg into free buffers of the ring, runs in the decoder thread"""
+        try:
+            while True:
+                if free.empty():
+                    self.decoder_stalls += 1
+                idx = free.get()
+                if idx is None or not self.readinto(proc, ring[idx]):
+                    break
+                decoded.put(idx)
+        except Exception as err:
+            decoded.put(err)
+            return
+        decoded.put(None)
+
+
+class FrameIndex(Ffmpeg):
+    """presentation time and keyframe flag of every frame of a video,
+    built once by demuxing the video without decoding it and cached next to the video,
+    or in the temporary folder of the system if the folder of the video is read-only"""
+    def __init__(self, infile, cache=None):
+        Ffmpeg.__init__(self, infile)
+        # the index is rebuilt if the video changed since it was cached
+        self.cache = cache or infile + ".index.npz"
+        # cache used when the one next to the video cannot be written, named after the path of the video
+        name = hashlib.sha1(os.path.abspath(infile).encode()).hexdigest() + ".index.npz"
+        self.fallback = os.path.join(tempfile.gettempdir(), "zftracking", name)
+        # presentation timestamps in units of time_base, sorted
+        self.pts = None
+        self.keyframes = None
+        self.time_base = None
+        if not self.load(self.cache) and not self.load(self.fallback):
+            self.build()
+            if not self.save(self.cache):
+                self.save(self.fallback)
+
+    def stamp(self):
+        """size and modification time of the video"""
+        stat = os.stat(self.infile)
+        return np.array([stat.st_size, stat.st_mtime_ns], np.int64)
+
+    def load(self, cache):
+        """reads a cached index, returns False if there is none for the current video"""
+        try:
+            with np.load(cache) as data:
+                if not np.array_equal(data["stamp"], self.stamp()):
+                    return False
+                self.pts = data["pts"]
+                self.keyframes = data["keyframes"]
+                self.time_base = tuple(int(v) for v in data["time_base"])
+                self.size = tuple(int(v) for v in data["size"])
+                self.fps = float(data["fps"])
+        except (OSError, KeyError, ValueError):
+            return False
+        return True
+
+    def save(self, cache):
+        """writes the index to a cache, returns False if the cache cannot be written,
+        the cache is replaced at once, so other processes never read a partly written file"""
+        temp = "%s.%d.tmp" % (cache, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(cache)), exist_ok=True)
+            with open(temp, "wb") as out:
+                np.savez(out, pts=self.pts, keyframes=self.keyframes, time_base=self.time_base,
+                         size=self.size, fps=self.fps, stamp=self.stamp())
+            os.replace(temp, cache)
+        except OSError:
+            if os.path.exists(temp):
+                os.remove(temp)
+            return False
+        return True
+
+    def build(self):
+        """reads timestamps and flags of all video packets from the framecrc muxer,
+        ffmpeg shifts the timestamps by the start time of the container, so they are seeked to with -ss,
+        missing timestamps, e.g. of most packets in AVI files, are generated by ffmpeg"""
+        args = [self.ffmpeg_location, "-hide_banner", "-loglevel", "panic", "-fflags", "+genpts", "-i", self.infile,
+                "-map", "0:v:0", "-c", "copy", "-f", "framecrc", "-"]
+        d = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        pts = []
+        keyframes = []
+        for line in d.stdout.decode(errors="replace").splitlines():
+            if line.startswith("#tb"):
+                num, den = line.split(":")[1].split("/")
+                self.time_base = (int(num), int(den))
+            elif line.startswith("#dimensions"):
+                width, height = line.split(":")[1].split("x")
+                self.size = (int(width), int(height))
+            elif line and not line.startswith("#"):
+                # stream, dts, pts, duration, size, checksum and flags if they differ from keyframe
+                fields = [field.strip() for field in line.split(",")]
+                if fields[2] == str(-2 ** 63):
+                    # packet without presentation timestamp
+                    continue
+                pts.append(int(fields[2]))
+                flags = 1
+                if len(fields) > 6 and fields[6].startswith("F="):
+                    flags = int(fields[6][2:], 16)
+                keyframes.append(bool(flags & 1))
+        if not pts:
+            raise IOError("no video stream found in " + self.infile)
+        # packets are stored in decoding order, frames are numbered in presentation order
+        order = np.argsort(pts, kind="stable")
+        self.pts = np.array(pts, np.int64)[order]
+        self.keyframes = np.array(keyframes, bool)[order]
+        # the frame rate of the stream, timestamps can be rounded to a coarse time base
+        size = self.size
+        self.probe()
+        self.size = size or self.size
+        if self.fps is None and len(self.pts) > 1:
+            self.fps = 1 / (np.median(np.diff(self.pts)) * self.time_base[0] / self.time_base[1])
+
+    @property
+    def nframes(self):
+        """exact number of frames in the video"""
+        return len(self.pts)
+
+    def times(self):
+        """seconds from the first frame to every frame"""
+        return (self.pts - self.pts[0]) * self.time_base[0] / self.time_base[1]
+
+    def time(self, frame):
+        """seconds from the first frame to the frame"""
+        return float((self.pts[frame] - self.pts[0]) * self.time_base[0] / self.time_base[1])
+
+    def frame_at(self, seconds):
+        """first frame shown at or after the given time"""
+        return int(np.searchsorted(self.times(), seconds))
+
+    def keyframe(self, frame):
+        """last keyframe at or before the frame, the first frame if the container marks no keyframe"""
+        keys = np.flatnonzero(self.keyframes)
+        idx = np.searchsorted(keys, frame, side="right") - 1
+        if idx < 0:
+            return 0
+        return int(keys[idx])
+
+    def timestamp(self, frame):
+        """presentation timestamp of the frame in seconds since the start of the container, as used by -ss"""
+        return float(self.pts[frame] * self.time_base[0] / self.time_base[1])
+
+    def seek_time(self, frame):
+        """timestamp for -ss to start decoding at the frame,
+        half a frame early so rounding never skips it"""
+        if frame == 0:
+            return self.timestamp(0)
+        return (self.timestamp(frame) + self.timestamp(frame - 1)) / 2
+
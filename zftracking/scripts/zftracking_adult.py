@@ -13,17 +13,37 @@ import os
 from datetime import datetime
 
 import errno
-import imageio
 import cv2
 from collections import deque
+from multiprocessing import Pool
 import colorsys
 import numpy as np
 import shutil
 
 from zftracking.external.runffmpeg import Ffmpeg
+from zftracking.external.runffmpeg import FfmpegReader
+from zftracking.external.runffmpeg import FrameIndex
 from zftracking.tracking.interactive_crop import Image
-from zftracking.tracking.cv_tracking import Point
+from zftracking.tracking.track_store import Point
+from zftracking.tracking.track_store import TrackStore
+from zftracking.tracking.track_store import concatenate
+from zftracking.tracking.cv_tracking import MotionGate
+from zftracking.tracking.cv_tracking import best_spot
+from zftracking.tracking.cv_tracking import candidate_windows
+from zftracking.tracking.cv_tracking import downsample
+from zftracking.tracking.cv_tracking import find_spots
+from zftracking.tracking.cv_tracking import refine_spots
+from zftracking.tracking.cv_tracking import gated_spots
+from zftracking.tracking.cv_tracking import predict_window
+from zftracking.tracking.cv_tracking import split_chunks
 from zftracking.tracking.analyze_tracks import Analysis
+from zftracking.tracking.zones import Zones
+
+# width the videos are scaled to for tracking
+WIDTH = 480
+# smallest difference in gray values to the background of foreground pixels in full resolution,
+# about what MOG2 decides with its default threshold and variance
+REFINE_THRESHOLD = 16
 
 
 def silent_remove(filename):
@@ -47,9 +67,39 @@ def main():
                         help="Keep temporary folder after execution.")
     parser.add_argument("--visual", action="store_true",
                         help="shows a visual representation of the tracking progress.")
+    parser.add_argument("-c", "--cpu", type=int, default=1,
+                        help="Number of processes tracking parts of each video in parallel.")
+    parser.add_argument("--components", action="store_true",
+                        help="Find spots with connected components instead of contours, faster with many spots.")
+    parser.add_argument("--gate", type=int, default=0,
+                        help="Half width in pixels of the window around the predicted position that is searched "
+                             "first, the whole frame is only searched when the fish is not found in it. "
+                             "0 always searches the whole frame. Cannot be combined with --pyramid.")
+    parser.add_argument("--pyramid", type=int, default=1,
+                        help="Decode the videos in full resolution, find the fish on frames downsampled by this "
+                             "factor and measure it in full resolution around them. 1 tracks frames scaled to a "
+                             "width of 480 instead. The fish has to stay a few pixels wide in the downsampled frames.")
+    parser.add_argument("--rolling", type=int, default=0,
+                        help="Number of frames the background model of MOG2 remembers, longer follows slower "
+                             "changes of the lighting. 0 keeps the default of 500 frames.")
+    parser.add_argument("--motion", type=int, default=0,
+                        help="Frames differing by at most this many gray values from the last tracked frame "
+                             "keep the last position instead of being tracked. 0 tracks every frame.")
+    parser.add_argument("--smoothing", choices=["adaptive", "mean", "median", "savgol"], default="adaptive",
+                        help="Filter smoothing the tracks before distances are measured, default is adaptive.")
+    parser.add_argument("--window", type=int, default=10,
+                        help="Number of track points in the smoothing window, default is 10.")
+    parser.add_argument("--prefetch", type=int, default=8,
+                        help="Number of frames decoded ahead in a background thread, 0 disables it.")
 
     # parse arguments from command line
     args = parser.parse_args()
+    if args.window < 1:
+        parser.error("--window has to be at least 1")
+    if args.gate and args.pyramid > 1:
+        # the window would be measured against the background image of MOG2, which keeps ghosts of the fish
+        # that the foreground mask searched by pyramid leaves out
+        parser.error("--gate cannot be combined with --pyramid")
     # get all file names and directories ready
     out_dir, temp_dir, video_bases, videos = housekeeping(args)
     borders = []
@@ -60,19 +110,19 @@ def main():
     for i in range(len(videos)):
         vbn = video_bases[i]
         v = videos[i]
-        scaled_video = "scaled_" + vbn + ".avi"
-        ffmpeg = Ffmpeg(v, os.path.join(temp_dir, scaled_video))
-        ffmpeg.f = "avi"
-        ffmpeg.vcodec = "libx264rgb"
-        ffmpeg.width = 480
-        ffmpeg.run()
-
-    for i in range(len(videos)):
-        vbn = video_bases[i]
-        pts = tracker(args, temp_dir, vbn)
-        border = borders[i]
-        tracks_lower, tracks_upper = split_tracks(border, pts)
-        analysis = Analysis(tracks_lower, tracks_upper, px_size=0.06)
+        pts = tracker(args, v, vbn)
+        # the points are in full resolution with pyramid, otherwise in frames scaled to a width of 480
+        full_width = FfmpegReader(v).out_size()[0]
+        width, height = FfmpegReader(v, width=None if args.pyramid > 1 else WIDTH).out_size()
+        border = borders[i] * width / full_width
+        # the region above the border is zone 1, the region below zone 0
+        zones = Zones((height, width))
+        zones.add_line((0, border), (width, border))
+        tracks_lower, tracks_upper = zones.split(pts)
+        # a pixel is 0.06 cm wide in frames scaled to a width of 480,
+        # the adaptive smoothing keeps blocks moving at least 10 of these pixels
+        analysis = Analysis(tracks_lower, tracks_upper, px_size=0.06 * WIDTH / width, smoothing=args.smoothing,
+                            window=args.window, min_distance=10 * width / WIDTH)
         analysis.analyze(os.path.join(out_dir, 'stats.txt'), vbn, vel=True)
 
     if not args.keep_temp:
@@ -83,7 +133,8 @@ def housekeeping(args):
     in_dir = os.path.abspath(args.in_path)
     videos = []
     for f in os.listdir(in_dir):
-        if os.path.isfile(os.path.join(in_dir, f)):
+        # skip the frame indexes cached next to the videos
+        if os.path.isfile(os.path.join(in_dir, f)) and not f.endswith(".index.npz"):
             videos.append(os.path.join(in_dir, f))
     video_names = []
     video_bases = []
@@ -114,115 +165,103 @@ def get_borders(borders, temp_dir, v):
     ffmpeg = Ffmpeg(v, os.path.join(thumb))
     ffmpeg.pix_fmt = "gray8"
     ffmpeg.vframes = "1"
-    ffmpeg.ss = "150"
+    ffmpeg.seek_keyframe(150)
     ffmpeg.run()
     image = Image(thumb, scaling=4)
     border = image.set_border()
-    border = int(np.mean((border[0][1], border[1][1])))
+    # the border is drawn on the thumbnail shrunk by the scaling, stored in full resolution
+    border = int(np.mean((border[0][1], border[1][1]))) * image.scaling
     borders.append(border)
 
 
-def split_tracks(border, pts):
-    tracks_lower = []
-    tracks_upper = []
-    idx_l = -1
-    idx_u = -1
-    prev_l = None
-    for pt in sorted(pts):
-        if prev_l is None:
-            if pts[pt].coords[1] < border:
-                prev_l = False
-                tracks_upper.append([pts[pt]])
-                idx_u += 1
-            else:
-                prev_l = True
-                tracks_lower.append([pts[pt]])
-                idx_l += 1
-        elif prev_l:
-            if pts[pt].coords[1] < border:
-                prev_l = False
-                idx_u += 1
-                tracks_upper.append([pts[pt]])
-            else:
-                tracks_lower[idx_l].append(pts[pt])
-        else:
-            if pts[pt].coords[1] < border:
-                tracks_upper[idx_u].append(pts[pt])
-            else:
-                prev_l = True
-                idx_l += 1
-                tracks_lower.append([pts[pt]])
-    return tracks_lower, tracks_upper
-
-
-def tracker(args, temp_dir, vbn):
-    scaled_video = "scaled_" + vbn + ".avi"
-    vid = imageio.get_reader(os.path.join(temp_dir, scaled_video), 'ffmpeg')
-    tot_frames = vid.get_meta_data()['nframes']
+def chunk_tracker(args, v, vbn, overlap=None):
+    """tracks chunks of the video in parallel processes and stitches their points,
+    each chunk is tracked from overlap frames earlier to pick up the previous track,
+    the default overlap is the history length of MOG2, so its background is settled"""
+    if overlap is None:
+        overlap = args.rolling or 500
+    chunks = split_chunks(FrameIndex(v).nframes, args.cpu)
+    with Pool(len(chunks)) as pool:
+        parts = pool.map(track_chunk, [(args, v, vbn, a, b, overlap) for a, b in chunks])
+    return concatenate(parts)
+
+
+def track_chunk(params):
+    """tracks a chunk of the video, runs in a worker process"""
+    args, v, vbn, start, end, overlap = params
+    args.visual = False
+    pts = tracker(args, v, vbn, max(start - overlap, 0), end, status=False)
+    return pts[pts.frame >= start]
+
+
+def tracker(args, v, vbn, start=None, end=None, status=True):
+    if args.cpu > 1 and start is None:
+        return chunk_tracker(args, v, vbn)
+    # with pyramid, the frames are decoded in full resolution and MOG2 runs on frames downsampled by pyramid,
+    # otherwise ffmpeg scales the video to a width of 480 while decoding
+    scale = args.pyramid
+    vid = FfmpegReader(v, width=None if scale > 1 else WIDTH, prefetch=args.prefetch, start=start, end=end)
+    tot_frames = vid.nframes
+    # the standard area of the fish is measured in frames with a width of 480
+    norm_area = 120 * (vid.out_size()[0] / WIDTH) ** 2
     kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-    fgbg = cv2.createBackgroundSubtractorMOG2()
-    pts = {}
-    previous_frame = False
-    counter = 0
+    # with rolling, MOG2 forgets the frames with this time constant instead of its default history of 500 frames
+    fgbg = cv2.createBackgroundSubtractorMOG2(history=args.rolling) if args.rolling else \
+        cv2.createBackgroundSubtractorMOG2()
+    pts = TrackStore()
+    previous = None
+    counter = start or 0
     skipped_frames = 0
+    gated_frames = 0
+    motion = MotionGate(args.motion)
     pt_buffer = deque(maxlen=100)
     for idx, frame in enumerate(vid):
-        fgmask = fgbg.apply(frame)
+        if motion.still(frame):
+            # nothing moved, the fish stays where it was if it was found in the frame before,
+            # the background model is not updated
+            spot = None
+            if previous is not None and previous.frame == counter - 1:
+                spot = Point(previous.coords, previous.area, counter, previous, norm_area=norm_area, a_weight=2)
+        elif scale > 1:
+            # spots are found on the downsampled frame and measured in full resolution around them
+            fgmask = fgbg.apply(downsample(frame, scale))
+            windows = candidate_windows(segment(fgmask, kernel), scale, frame.shape)
+            background = fgbg.getBackgroundImage() if windows else None
+            refine = lambda w: refine_mask(frame, background, scale, kernel, w)
+            spots = refine_spots(refine, frame.shape, windows, args.components)
+            if spots is None:
+                # a spot is cut by a window, measure the whole frame
+                spots = find_spots(refine((slice(0, frame.shape[0]), slice(0, frame.shape[1]))), args.components)
+            spot = best_spot(spots[0], spots[1], counter, previous, norm_area=norm_area, a_weight=2)
+        else:
+            # the background model is updated with the whole frame
+            fgmask = fgbg.apply(frame)
+            # with gate, the mask is only cleaned and searched around the predicted position
+            window = predict_window(pts, counter, fgmask.shape, args.gate)
+            centers, areas, gated = gated_spots(lambda w: segment(fgmask, kernel, w), fgmask.shape,
+                                                window, args.components)
+            gated_frames += gated
+            # score all spots at once and add the best one to the point store
+            spot = best_spot(centers, areas, counter, previous, norm_area=norm_area, a_weight=2)
         if args.visual:
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        fgmask = cv2.morphologyEx(fgmask, cv2.MORPH_OPEN, kernel)
-        mask = cv2.inRange(fgmask, 128, 256)
-        contours = cv2.findContours(mask.copy(),
-                                    cv2.RETR_EXTERNAL,
-                                    cv2.CHAIN_APPROX_SIMPLE)[-2]
-        if len(contours) > 0:
-            if not previous_frame:
-                # for the first frame in the video, just find the largest contour in the mask
-                c = max(contours, key=cv2.contourArea)
-                # compute center point
-                m = cv2.moments(c)
-                try:
-                    center = (int(m["m10"] / m["m00"]), int(m["m01"] / m["m00"]))
-                except ZeroDivisionError:
-                    continue
-                # add point to the points dictionary
-                pts[counter] = Point(center, cv2.contourArea(c), counter, norm_area=120, a_weight=2)
-                if args.visual:
-                    pt_buffer.append(pts[counter].coords)
-                    cv2.circle(frame, pts[counter].coords, 15, (0, 0, 255), 1)
-                previous_frame = counter
-            else:
-                # make a list of possible spots and choose the one with the highest score
-                candidate_pts = []
-                for c in contours:
-                    m = cv2.moments(c)
-                    try:
-                        center = (int(m["m10"] / m["m00"]), int(m["m01"] / m["m00"]))
-                    except ZeroDivisionError:
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+        if spot is not None:
+            previous = spot
+            pts.append_point(previous)
+            if args.visual:
+                pt_buffer.append(previous.coords)
+                cv2.circle(frame, previous.coords, 15, (0, 0, 255), 1)
+                for i in range(1, len(pt_buffer)):
+                    b, g, r = get_colors(i, pt_buffer)
+                    if pt_buffer[i - 1] is None or pt_buffer[i] is None:
                         continue
-                    candidate_pts.append(Point(center,
-                                               cv2.contourArea(c),
-                                               counter,
-                                               pts[previous_frame],
-                                               norm_area=120,
-                                               a_weight=2))
-                if len(candidate_pts) >= 1:
-                    # add the best spot to the points dictionary
-                    c = sorted(candidate_pts)[-1]
-                    pts[counter] = c
-                    if args.visual:
-                        pt_buffer.append(pts[counter].coords)
-                        cv2.circle(frame, pts[counter].coords, 15, (0, 0, 255), 1)
-                        for i in range(1, len(pt_buffer)):
-                            b, g, r = get_colors(i, pt_buffer)
-                            if pt_buffer[i - 1] is None or pt_buffer[i] is None:
-                                continue
-                            cv2.line(frame, pt_buffer[i - 1], pt_buffer[i], (b, g, r), 1, cv2.LINE_AA)
-                    previous_frame = counter
-                else:
-                    skipped_frames += 1
+                    cv2.line(frame, pt_buffer[i - 1], pt_buffer[i], (b, g, r), 1, cv2.LINE_AA)
+        elif previous is not None:
+            # no spot found after the first detection
+            skipped_frames += 1
         counter += 1
-        status_bar(counter, tot_frames, vbn)
+        if status:
+            status_bar(counter, tot_frames, vbn)
         if args.visual:
             cv2.imshow('frame', frame)
             k = cv2.waitKey(1) & 0xff
@@ -230,10 +269,42 @@ def tracker(args, temp_dir, vbn):
                 cv2.destroyAllWindows()
                 cv2.waitKey(1) & 0xff
                 args.visual = False
+    if not status:
+        return pts
     print('\n')
+    if args.motion:
+        print("skipped " + str(motion.gated) + " of " + str(counter - (start or 0)) + " frames without motion")
+    if args.gate:
+        print("searched " + str(gated_frames) + " of " + str(counter - (start or 0)) +
+              " frames only around the predicted position")
+    if args.prefetch:
+        # stalls show whether decoding or tracking is the bottleneck
+        print("decoder waited " + str(vid.decoder_stalls) + " times, tracker waited " +
+              str(vid.tracker_stalls) + " times")
     return pts
 
 
+def segment(fgmask, kernel, window=None):
+    """cleans the foreground mask of MOG2 and returns the mask of the spots, only of the window if one is given"""
+    if window is not None:
+        fgmask = fgmask[window]
+    fgmask = cv2.morphologyEx(fgmask, cv2.MORPH_OPEN, kernel)
+    return cv2.inRange(fgmask, 128, 256)
+
+
+def refine_mask(frame, background, scale, kernel, window):
+    """foreground mask of a full resolution window of the frame,
+    from the difference to the MOG2 background of the frames downsampled by scale"""
+    rows, cols = window
+    # map the pixel centers of the window to the downsampled background
+    offset = np.float32([[1 / scale, 0, (cols.start + 0.5) / scale - 0.5],
+                         [0, 1 / scale, (rows.start + 0.5) / scale - 0.5]])
+    upsampled = cv2.warpAffine(background, offset, (cols.stop - cols.start, rows.stop - rows.start),
+                               flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_REPLICATE)
+    mask = cv2.inRange(cv2.absdiff(frame[window], upsampled), REFINE_THRESHOLD, 255)
+    return cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+
+
 def status_bar(counter, tot_frames, vbn):
     print('\r' + vbn + ' |' + int(counter / tot_frames * 40) * "=" + int(
         40 - (counter / tot_frames * 40)) * "_" + '| ' + str(counter), end='')
@@ -7,57 +7,29 @@ Created on Fri Dec 2 2016
 
 Script that tracks larvae in circular arenas.
 
-Needs ffmpeg and FIJI to run.
+Needs ffmpeg to run.
 """
 
 import argparse
 import os
 from datetime import datetime
-
-import errno
+from multiprocessing import Pool
 
 import shutil
 
 from zftracking.tracking.interactive_crop import Image
+from zftracking.tracking.interactive_crop import PLATE_LAYOUTS
 from zftracking.external.runffmpeg import Ffmpeg
-from zftracking.tracking.analyze_tracks import Analysis
-from zftracking.tracking.analyze_tracks import distance
-from zftracking.tracking.cv_tracking import Video
-
-
-def silent_remove(filename):
-    """removes file without error on non existing file"""
-    try:
-        os.remove(filename)
-    except OSError as err:
-        if err.errno != errno.ENOENT:  # errno.ENOENT = no such file or directory
-            raise  # re-raise exception if a different error occurred
-
-
-def crop_and_mask(infile, temp_dir, thumb, prev_crop=False, prev_mask=False):
-    """initiates the interactive cropping and masking of the video"""
-    image = Image(thumb, prev_crop=prev_crop)
-    crop = image.crop()
-    silent_remove(os.path.join(temp_dir, "crop.tiff"))
-    ffmpeg = Ffmpeg(infile, os.path.join(temp_dir, "crop.tiff"))
-    ffmpeg.pix_fmt = "gray8"
-    ffmpeg.vframes = "1"
-    ffmpeg.ss = "150"
-    ffmpeg.filter = "crop=" + crop
-    ffmpeg.run()
-    image = Image(os.path.join(temp_dir, "crop.tiff"), prev_mask=prev_mask)
-    mask = image.mask()
-    return crop, mask
-
-
-def prepare_vid(cropped_video, infile, temp_dir, crop):
-    """get FIJI compatible avi from video"""
-    ffmpeg = Ffmpeg(infile, temp_dir + cropped_video)
-    ffmpeg.pix_fmt = "nv12"
-    ffmpeg.f = "avi"
-    ffmpeg.vcodec = "rawvideo"
-    ffmpeg.filter = "crop=" + crop
-    ffmpeg.run()
+from zftracking.tracking.analyze_tracks import write_stats
+from zftracking.tracking.wells import check_plate_options
+from zftracking.tracking.wells import crop_and_mask
+from zftracking.tracking.wells import crop_thumbnails
+from zftracking.tracking.wells import load_well
+from zftracking.tracking.wells import print_report
+from zftracking.tracking.wells import save_well
+from zftracking.tracking.wells import silent_remove
+from zftracking.tracking.wells import track_plate
+from zftracking.tracking.wells import track_well
 
 
 def main():
@@ -65,95 +37,83 @@ def main():
     args = get_arguments()
     # get all file names and directories ready
     infile = os.path.abspath(args.in_path)
-    video_name = os.path.basename(infile)
-    video_name_base = os.path.splitext(video_name)[0]
     out_dir = os.path.abspath(args.out_path)
     prep_outfile(out_dir)
     if not out_dir.endswith('/'):
         out_dir += '/'
     # make directory for temporary results
     temp_dirs = []
-    seg_paths = []
     for i in range(args.number):
         temp_dirs.append(os.path.join(out_dir, "temp_" + str(i) + "/"))
-        # segmentation path does not include file extension,
-        # it will be appended in FIJI macro
-        seg_paths.append(os.path.join(out_dir, "SEG_" + str(i) + '_' + video_name_base))
-    cropped_video = "cropped_" + video_name_base + ".avi"
     thumb = 'thumb.tiff'
-    start_frame = None
+    start_frame = args.start
     end_frame = None
+    if args.end is not None:
+        end_frame = args.end + 1
     for temp_dir in temp_dirs:
         if not os.path.exists(temp_dir):
             os.makedirs(temp_dir)
 
     crops = []
     masks = []
-    silent_remove(os.path.join(temp_dirs[0], "thumb.tiff"))
-    ffmpeg = Ffmpeg(infile, os.path.join(temp_dirs[0], thumb))
-    ffmpeg.pix_fmt = "gray8"
-    ffmpeg.vframes = "1"
-    ffmpeg.ss = "150"
-    ffmpeg.run()
-
-    thumb = os.path.join(temp_dirs[0], thumb)
-    if not args.manual_crop and args.number == 24:
-        # crop the image into 24 parts
-        # let the user choose the region in which the wells are.
-        image = Image(thumb)
-        crops = image.auto_crop()
-        prev_mask = False
-        for i in range(len(crops)):
-            crop = crops[i]
-            temp_dir = temp_dirs[i]
-            silent_remove(os.path.join(temp_dir, "crop.tiff"))
-            ffmpeg = Ffmpeg(infile, os.path.join(temp_dir, "crop.tiff"))
-            ffmpeg.pix_fmt = "gray8"
-            ffmpeg.vframes = "1"
-            ffmpeg.ss = "150"
-            ffmpeg.filter = "crop=" + crop
-            ffmpeg.run()
-            image = Image(os.path.join(temp_dir, "crop.tiff"), prev_mask=prev_mask)
-            prev_mask = image.mask()
-            masks.append(prev_mask)
-    else:
-        m = (0, 0)
+    if not args.only_tracking:
+        silent_remove(os.path.join(temp_dirs[0], "thumb.tiff"))
+        ffmpeg = Ffmpeg(infile, os.path.join(temp_dirs[0], thumb))
+        ffmpeg.pix_fmt = "gray8"
+        ffmpeg.vframes = "1"
+        ffmpeg.seek_keyframe(150)
+        ffmpeg.run()
+
+        thumb = os.path.join(temp_dirs[0], thumb)
+        if not args.manual_crop and args.number in PLATE_LAYOUTS:
+            # crop the image into the wells of the plate
+            # let the user choose the region in which the wells are.
+            image = Image(thumb)
+            crops = image.auto_crop(args.number)
+            crop_thumbnails(infile, temp_dirs, crops)
+            prev_mask = False
+            for i in range(len(crops)):
+                temp_dir = temp_dirs[i]
+                image = Image(os.path.join(temp_dir, "crop.tiff"), prev_mask=prev_mask)
+                prev_mask = image.mask()
+                masks.append(prev_mask)
+        else:
+            m = (0, 0)
+            for i in range(len(temp_dirs)):
+                # prepare cropping and masking
+                temp_dir = temp_dirs[i]
+                if len(crops) == 0:
+                    c, m = crop_and_mask(infile, temp_dir, thumb)
+                    crops.append(c)
+                    masks.append(m)
+                else:
+                    c, m = crop_and_mask(infile, temp_dir, thumb, crops[-1], m)
+                    crops.append(c)
+                    masks.append(m)
         for i in range(len(temp_dirs)):
-            # prepare cropping and masking
-            temp_dir = temp_dirs[i]
-            if len(crops) == 0:
-                c, m = crop_and_mask(infile, temp_dir, thumb)
-                crops.append(c)
-                masks.append(m)
-            else:
-                c, m = crop_and_mask(infile, temp_dir, thumb, crops[-1], m)
-                crops.append(c)
-                masks.append(m)
+            save_well(temp_dirs[i], crops[i], masks[i], start_frame, end_frame)
+    else:
+        # the wells and frame range of the previous run, so its checkpoints are continued
+        for temp_dir in temp_dirs:
+            c, m, start_frame, end_frame = load_well(temp_dir)
+            crops.append(c)
+            masks.append(m)
 
-    for i in range(len(temp_dirs)):
-        temp_dir = temp_dirs[i]
-        crop = crops[i]
-        prepare_vid(cropped_video, infile, temp_dir, crop)
+    if args.single_decode or args.plate_wide:
+        # decode the plate video once and slice every frame into the wells
+        plate_tracks = track_plate(args, infile, crops, start_frame, end_frame)
+    else:
+        plate_tracks = [None] * len(temp_dirs)
 
+    jobs = []
     for i in range(len(temp_dirs)):
-        # track the segmented video
-        temp_dir = temp_dirs[i]
-        mask = masks[i]
-        vid = Video(temp_dir + cropped_video)
-        tracks = vid.track()
-        outer_tracks = []
-        inner_tracks = []
-        for track in tracks:
-            outer_track, inner_track = (split_tracks(mask, track))
-            outer_tracks += outer_track
-            inner_tracks += inner_track
-        analysis = Analysis(outer_tracks, inner_tracks)
-        analysis.analyze(out_dir + 'stats.txt', i)
-        if args.save_track_image:
-            analysis.save_track_image(temp_dirs[i], out_dir, i)
-        if args.save_track:
-            # save track points to file
-            analysis.save_track(out_dir, i)
+        jobs.append((args, infile, crops[i], masks[i], temp_dirs[i], out_dir, i,
+                     start_frame, end_frame, plate_tracks[i]))
+    with Pool(args.cpu) as pool:
+        # imap returns the wells in order, so stats.txt is written in the same order every time
+        for i, (stats, report) in enumerate(pool.imap(track_well, jobs)):
+            write_stats(out_dir + 'stats.txt', i, stats)
+            print_report("well " + str(i), report)
 
     if not args.keep_temp:
         for temp_dir in temp_dirs:
@@ -180,8 +140,12 @@ def get_arguments():
                         help="Directory for results. Should be empty.")
     parser.add_argument("-x", "--keep_temp", action="store_true",
                         help="Keep temporary folder after execution.")
+    parser.add_argument("-t", "--only_tracking", action="store_true",
+                        help="Only perform tracking step, with the wells and frame range of a previous run "
+                             "kept with -x or interrupted.")
     parser.add_argument("-n", "--number", type=int, default=24,
-                        help="Number of wells to track, default is 24")
+                        help="Number of wells to track, default is 24. Plates with 6, 12, 24, 48 or 96 wells "
+                             "are split into wells automatically.")
     parser.add_argument("-i", "--save_track_image", action="store_true",
                         help="Save images of tracked paths.")
     parser.add_argument("-m", "--manual_crop", action="store_true",
@@ -190,54 +154,60 @@ def get_arguments():
                         help="Save track points to file.")
     parser.add_argument("--median", action="store_true",
                         help="Use median intensity projection for segmentation.")
+    parser.add_argument("-c", "--cpu", type=int, default=1,
+                        help="Set number of processes tracking wells in parallel.")
+    parser.add_argument("--single_decode", action="store_true",
+                        help="Decode the video once and pass every frame to the trackers of all wells "
+                             "instead of decoding it once per well, the wells are tracked in one process.")
+    parser.add_argument("--plate_wide", action="store_true",
+                        help="Segment the whole plate at once and assign the spots to the wells, "
+                             "faster for plates with many wells. The blur of the whole plate mixes pixels across "
+                             "the edges of the wells, so spots near the edges can differ from tracking the wells "
+                             "separately. Implies --single_decode and reads the video twice like --big. Cannot be "
+                             "combined with --gate, --motion, --pyramid or --rolling.")
+    parser.add_argument("--big", action="store_true",
+                        help="Reduces memory usage for very large video files by reading them twice "
+                             "instead of keeping all frames in memory.")
+    parser.add_argument("--start", type=int,
+                        help="First frame to keep, earlier frames are not decoded.")
+    parser.add_argument("--end", type=int,
+                        help="Last frame to keep, later frames are not decoded.")
+    parser.add_argument("--components", action="store_true",
+                        help="Find spots with connected components instead of contours, faster with many spots.")
+    parser.add_argument("--gate", type=int, default=0,
+                        help="Half width in pixels of the window around the predicted position that is searched "
+                             "first, the whole frame is only searched when the larva is not found in it. "
+                             "0 always searches the whole frame.")
+    parser.add_argument("--motion", type=int, default=0,
+                        help="Frames differing by at most this many gray values from the last tracked frame "
+                             "keep the last position instead of being tracked. 0 tracks every frame.")
+    parser.add_argument("--pyramid", type=int, default=1,
+                        help="Find the larva on frames downsampled by this factor first and only segment the "
+                             "regions around it in full resolution. 1 segments every frame in full resolution.")
+    parser.add_argument("--rolling", type=int, default=0,
+                        help="Time constant in frames of a background following slow changes of the lighting, "
+                             "the video is then tracked in a single pass. 0 uses one background for the whole "
+                             "video.")
+    parser.add_argument("--checkpoint", type=int, default=0,
+                        help="With --rolling, save the tracking state to the temporary folder every this many "
+                             "frames, an interrupted run continues from it with -t. 0 disables checkpoints. "
+                             "Cannot be combined with --single_decode or --plate_wide.")
+    parser.add_argument("--smoothing", choices=["adaptive", "mean", "median", "savgol"], default="adaptive",
+                        help="Filter smoothing the tracks before distances are measured, default is adaptive.")
+    parser.add_argument("--window", type=int, default=10,
+                        help="Number of track points in the smoothing window, default is 10.")
+    parser.add_argument("--prefetch", type=int, default=8,
+                        help="Number of frames decoded ahead in a background thread, 0 disables it.")
     # parse arguments from command line
     args = parser.parse_args()
+    check_plate_options(parser, args)
+    if args.only_tracking and (args.start is not None or args.end is not None):
+        parser.error("-t tracks the frame range of the previous run, it cannot be combined with --start or --end")
+    if args.window < 1:
+        parser.error("--window has to be at least 1")
     return args
 
 
-def isinside(center, radius, point) -> bool:
-    dist = distance([center, point.coords])
-    if dist > radius:
-        return False
-    else:
-        return True
-
-
-def split_tracks(mask, pts):
-    center = mask[0]
-    radius = mask[1]
-    tracks_outer = []
-    tracks_inner = []
-    idx_o = -1
-    idx_i = -1
-    prev_o = None
-    for pt in pts:
-        if prev_o is None:
-            if isinside(center, radius, pt):
-                prev_o = False
-                tracks_inner.append([pt])
-                idx_i += 1
-            else:
-                prev_o = True
-                tracks_outer.append([pt])
-                idx_o += 1
-        elif prev_o:
-            if isinside(center, radius, pt):
-                prev_o = False
-                idx_i += 1
-                tracks_inner.append([pt])
-            else:
-                tracks_outer[idx_o].append(pt)
-        else:
-            if isinside(center, radius, pt):
-                tracks_inner[idx_i].append(pt)
-            else:
-                prev_o = True
-                idx_o += 1
-                tracks_outer.append([pt])
-    return tracks_outer, tracks_inner
-
-
 if __name__ == '__main__':
     start = datetime.now()
     main()
@@ -7,56 +7,28 @@ Created on Tue Oct 18 2016
 
 Script that tracks larvae in circular arenas.
 
-Needs ffmpeg and FIJI to run.
+Needs ffmpeg to run.
 """
 
 import argparse
-import errno
 import os
 import shutil
 from datetime import datetime
-from threading import Thread
+from multiprocessing import Pool
 
 from zftracking.external.runffmpeg import Ffmpeg
-from zftracking.external.runfiji import ImageJMacro
-from zftracking.tracking.analyze_tracks import Analysis
-from zftracking.tracking.cv_tracking import Video
-from zftracking.tracking.interactive_crop_backup import Image
-
-
-def silent_remove(filename):
-    """removes file without error on non existing file"""
-    try:
-        os.remove(filename)
-    except OSError as err:
-        if err.errno != errno.ENOENT:  # errno.ENOENT = no such file or directory
-            raise                    # re-raise exception if a different error occurred
-
-
-def crop_and_mask(infile, mask_path, temp_dir, thumb, prev_crop=False, prev_mask=False):
-    """initiates the interactive cropping and masking of the video"""
-    image = Image(thumb, prev_crop=prev_crop)
-    crop = image.crop()
-    silent_remove(os.path.join(temp_dir, "crop.tiff"))
-    ffmpeg = Ffmpeg(infile, os.path.join(temp_dir, "crop.tiff"))
-    ffmpeg.pix_fmt = "gray8"
-    ffmpeg.vframes = "1"
-    ffmpeg.ss = "150"
-    ffmpeg.filter = "crop=" + crop
-    ffmpeg.run()
-    image = Image(os.path.join(temp_dir, "crop.tiff"), prev_mask=prev_mask)
-    mask = image.mask(mask_path)
-    return crop, mask
-
-
-def prepare_vid(cropped_video, infile, temp_dir, crop):
-    """get FIJI compatible avi from video"""
-    ffmpeg = Ffmpeg(infile, temp_dir + cropped_video)
-    ffmpeg.pix_fmt = "nv12"
-    ffmpeg.f = "avi"
-    ffmpeg.vcodec = "rawvideo"
-    ffmpeg.filter = "crop=" + crop
-    ffmpeg.run()
+from zftracking.tracking.analyze_tracks import write_stats
+from zftracking.tracking.interactive_crop import Image
+from zftracking.tracking.interactive_crop import PLATE_LAYOUTS
+from zftracking.tracking.wells import check_plate_options
+from zftracking.tracking.wells import crop_and_mask
+from zftracking.tracking.wells import crop_thumbnails
+from zftracking.tracking.wells import load_well
+from zftracking.tracking.wells import print_report
+from zftracking.tracking.wells import save_well
+from zftracking.tracking.wells import silent_remove
+from zftracking.tracking.wells import track_plate
+from zftracking.tracking.wells import track_well
 
 
 def main():
@@ -71,9 +43,10 @@ def main():
     parser.add_argument("-x", "--keep_temp", action="store_true",
                         help="Keep temporary folder after execution.")
     parser.add_argument("-t", "--only_tracking", action="store_true",
-                        help="Only perform tracking step.")
+                        help="Only perform tracking step, with the wells of a previous run kept with -x.")
     parser.add_argument("-n", "--number", type=int, default=24,
-                        help="Number of wells to track, default is 24")
+                        help="Number of wells to track, default is 24. Plates with 6, 12, 24, 48 or 96 wells "
+                             "are split into wells automatically.")
     parser.add_argument("-i", "--save_track_image", action="store_true",
                         help="Save images of tracked paths.")
     parser.add_argument("-m", "--manual_crop", action="store_true",
@@ -83,16 +56,52 @@ def main():
     parser.add_argument("--median", action="store_true",
                         help="Use median intensity projection for segmentation.")
     parser.add_argument("-c", "--cpu", type=int, default=1,
-                        help="Set number of threads for multi core machines.")
+                        help="Set number of processes tracking wells in parallel.")
+    parser.add_argument("--single_decode", action="store_true",
+                        help="Decode the video once and pass every frame to the trackers of all wells "
+                             "instead of decoding it once per well, the wells are tracked in one process.")
+    parser.add_argument("--plate_wide", action="store_true",
+                        help="Segment the whole plate at once and assign the spots to the wells, "
+                             "faster for plates with many wells. The blur of the whole plate mixes pixels across "
+                             "the edges of the wells, so spots near the edges can differ from tracking the wells "
+                             "separately. Implies --single_decode and reads the video twice like --big. Cannot be "
+                             "combined with --gate, --motion, --pyramid or --rolling.")
     parser.add_argument("--big", action="store_true",
                         help="Reduces memory usage for very large video files (time intensive, not recommended).")
+    parser.add_argument("--components", action="store_true",
+                        help="Find spots with connected components instead of contours, faster with many spots.")
+    parser.add_argument("--gate", type=int, default=0,
+                        help="Half width in pixels of the window around the predicted position that is searched "
+                             "first, the whole frame is only searched when the larva is not found in it. "
+                             "0 always searches the whole frame.")
+    parser.add_argument("--motion", type=int, default=0,
+                        help="Frames differing by at most this many gray values from the last tracked frame "
+                             "keep the last position instead of being tracked. 0 tracks every frame.")
+    parser.add_argument("--pyramid", type=int, default=1,
+                        help="Find the larva on frames downsampled by this factor first and only segment the "
+                             "regions around it in full resolution. 1 segments every frame in full resolution.")
+    parser.add_argument("--rolling", type=int, default=0,
+                        help="Time constant in frames of a background following slow changes of the lighting, "
+                             "the video is then tracked in a single pass. 0 uses one background for the whole "
+                             "video.")
+    parser.add_argument("--checkpoint", type=int, default=0,
+                        help="With --rolling, save the tracking state to the temporary folder every this many "
+                             "frames, an interrupted run continues from it with -t. 0 disables checkpoints. "
+                             "Cannot be combined with --single_decode or --plate_wide.")
+    parser.add_argument("--smoothing", choices=["adaptive", "mean", "median", "savgol"], default="adaptive",
+                        help="Filter smoothing the tracks before distances are measured, default is adaptive.")
+    parser.add_argument("--window", type=int, default=10,
+                        help="Number of track points in the smoothing window, default is 10.")
+    parser.add_argument("--prefetch", type=int, default=8,
+                        help="Number of frames decoded ahead in a background thread, 0 disables it.")
 
     # parse arguments from command line
     args = parser.parse_args()
+    check_plate_options(parser, args)
+    if args.window < 1:
+        parser.error("--window has to be at least 1")
     # get all file names and directories ready
     infile = os.path.abspath(args.in_path)
-    video_name = os.path.basename(infile)
-    video_name_base = os.path.splitext(video_name)[0]
     out_dir = os.path.abspath(args.out_path)
     with open(os.path.join(out_dir, 'stats.txt'), 'w') as out:
         out.write('well\t')
@@ -106,134 +115,88 @@ def main():
         out_dir += '/'
     # make directory for temporary results
     temp_dirs = []
-    seg_paths = []
     for i in range(args.number):
         temp_dirs.append(os.path.join(out_dir, "temp_" + str(i) + "/"))
-        # segmentation path does not include file extension,
-        # it will be appended in FIJI macro
-        seg_paths.append(os.path.join(out_dir, "SEG_" + str(i) + '_' + video_name_base))
-    cropped_video = "cropped_" + video_name_base + ".avi"
     thumb = 'thumb.tiff'
-    mask_paths = []
-    start_frame = False
-    end_frame = False
+    start_frame = None
+    end_frame = None
     for temp_dir in temp_dirs:
         if not os.path.exists(temp_dir):
             os.makedirs(temp_dir)
-        mask_paths.append(os.path.join(temp_dir, "mask.tiff"))
 
     crops = []
+    masks = []
     if not args.only_tracking:
         silent_remove(os.path.join(temp_dirs[0], "thumb.tiff"))
         ffmpeg = Ffmpeg(infile, os.path.join(temp_dirs[0], thumb))
         ffmpeg.pix_fmt = "gray8"
         ffmpeg.vframes = "1"
-        ffmpeg.ss = "150"
+        ffmpeg.seek_keyframe(150)
         ffmpeg.run()
 
         thumb = os.path.join(temp_dirs[0], thumb)
-        if not args.manual_crop and args.number == 24:
-            # crop the image into 24 parts
+        if not args.manual_crop and args.number in PLATE_LAYOUTS:
+            # crop the image into the wells of the plate
             # let the user choose the region in which the wells are.
             image = Image(thumb)
-            crops = image.auto_crop()
+            crops = image.auto_crop(args.number)
+            crop_thumbnails(infile, temp_dirs, crops)
             prev_mask = False
             for i in range(len(crops)):
-                crop = crops[i]
                 temp_dir = temp_dirs[i]
-                mask_path = mask_paths[i]
-                silent_remove(os.path.join(temp_dir, "crop.tiff"))
-                ffmpeg = Ffmpeg(infile, os.path.join(temp_dir, "crop.tiff"))
-                ffmpeg.pix_fmt = "gray8"
-                ffmpeg.vframes = "1"
-                ffmpeg.ss = "150"
-                ffmpeg.filter = "crop=" + crop
-                ffmpeg.run()
                 image = Image(os.path.join(temp_dir, "crop.tiff"), prev_mask=prev_mask)
-                prev_mask = image.mask(mask_path)
+                prev_mask = image.mask()
+                masks.append(prev_mask)
         else:
             m = (0, 0)
             for i in range(len(temp_dirs)):
                 # prepare cropping and masking
                 temp_dir = temp_dirs[i]
-                mask_path = mask_paths[i]
                 if len(crops) == 0:
-                    c, m = crop_and_mask(infile, mask_path, temp_dir, thumb)
+                    c, m = crop_and_mask(infile, temp_dir, thumb)
                     crops.append(c)
+                    masks.append(m)
                 else:
-                    c, m = crop_and_mask(infile, mask_path, temp_dir, thumb, crops[-1], m)
+                    c, m = crop_and_mask(infile, temp_dir, thumb, crops[-1], m)
                     crops.append(c)
-        i = 0
-        while i < len(temp_dirs):
-            threads = {}
-            for thread in range(args.cpu):
-                try:
-                    temp_dir = temp_dirs[i]
-                    crop = crops[i]
-                    # prepare the video for segmentation
-                    threads[thread] = Thread(target=prepare_vid,
-                                             args=[cropped_video, infile, temp_dir, crop])
-                    threads[thread].start()
-                    i += 1
-                except IndexError:
-                    break
-            for thread in threads:
-                threads[thread].join()
-            while not start_frame:
-                try:
-                    start_frame = int(input("First frame to keep: "))
-                except ValueError:
-                    start_frame = False
-            while not end_frame:
-                try:
-                    end_frame = int(input("Last frame to keep: ")) + 1
-                except ValueError:
-                    end_frame = False
+                    masks.append(m)
+        # 0 is a valid frame, so the loops test for None
+        while start_frame is None:
+            try:
+                start_frame = int(input("First frame to keep: "))
+            except ValueError:
+                start_frame = None
+        while end_frame is None:
+            try:
+                end_frame = int(input("Last frame to keep: ")) + 1
+            except ValueError:
+                end_frame = None
         for i in range(len(temp_dirs)):
-            # segment the video
-            temp_dir = temp_dirs[i]
-            mask_path = mask_paths[i]
-            seg_path = seg_paths[i]
-            # run the segmentation macro
-            if args.median:
-                fiji = ImageJMacro("segmentation_median")
-            else:
-                fiji = ImageJMacro("segmentation")
-            fiji.run([temp_dir + cropped_video, str(start_frame),
-                      str(end_frame), seg_path, mask_path])
-
-    for i in range(len(seg_paths)):
-        # track outer region
-        seg_path = seg_paths[i]
-        if args.big:
-            outer = Video(seg_path + "_outer.tiff", big=True)
-        else:
-            outer = Video(seg_path + "_outer.tiff")
-        outer_tracks = outer.track()
-        del outer
-        # track inner region
-        if args.big:
-            inner = Video(seg_path + "_inner.tiff", big=True)
-        else:
-            inner = Video(seg_path + "_inner.tiff")
-        inner_tracks = inner.track()
-        del inner
-        analysis = Analysis(outer_tracks, inner_tracks)
-        analysis.analyze(out_dir + 'stats.txt', i)
-        if args.save_track_image:
-            analysis.save_track_image(temp_dirs[i], out_dir, i)
-        if args.save_track:
-            # save track points to file
-            analysis.save_track(out_dir, i)
+            save_well(temp_dirs[i], crops[i], masks[i], start_frame, end_frame)
+    else:
+        for temp_dir in temp_dirs:
+            c, m, start_frame, end_frame = load_well(temp_dir)
+            crops.append(c)
+            masks.append(m)
+
+    if args.single_decode or args.plate_wide:
+        # decode the plate video once and slice every frame into the wells
+        plate_tracks = track_plate(args, infile, crops, start_frame, end_frame)
+    else:
+        plate_tracks = [None] * len(temp_dirs)
+
+    # every well is decoded and tracked once, the tracks are split into the zones afterwards
+    jobs = [(args, infile, crops[i], masks[i], temp_dirs[i], out_dir, i, start_frame, end_frame, plate_tracks[i])
+            for i in range(len(temp_dirs))]
+    with Pool(args.cpu) as pool:
+        # imap returns the wells in order, so stats.txt is written in the same order every time
+        for i, (stats, report) in enumerate(pool.imap(track_well, jobs)):
+            write_stats(out_dir + 'stats.txt', i, stats)
+            print_report("well " + str(i), report)
 
     if not args.keep_temp:
         for temp_dir in temp_dirs:
             shutil.rmtree(temp_dir)
-        for i in range(args.number):
-            silent_remove(os.path.join(out_dir,
-                                       "SEG_" + str(i) + '_' + video_name_base + "_outer.tiff"))
-            silent_remove(os.path.join(out_dir,
-                                       "SEG_" + str(i) + '_' + video_name_base + "_inner.tiff"))
 
     end = datetime.now()
     print("Executed in " + str(end-start))
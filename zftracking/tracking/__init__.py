@@ -0,0 +1,2 @@
+__all__ = ['analyze_tracks', 'background', 'cv_tracking', 'interactive_crop', 'smoothing', 'track_store',
+           'wells', 'zones']
@@ -2,12 +2,13 @@
 
 import colorsys
 import os
-from collections import deque
 
 import numpy as np
 
 import cv2
 
+from zftracking.tracking.smoothing import SMOOTHERS
+
 
 def distance(pts):
     """calculates distance between two points"""
@@ -18,52 +19,107 @@ def distance(pts):
     return np.sqrt(x_dist ** 2 + y_dist ** 2)
 
 
-def mean(pts):
-    """calculates mean coordinates of track points"""
-    avg = []
-    for i in zip(*pts):
-        avg.append(int(np.mean(i)))
-    return tuple(avg)
-
-
-def median(pts):
-    """calculates median coordinates of track points"""
-    mdn = []
-    for i in zip(*pts):
-        mdn.append(int(np.median(i)))
-    return tuple(mdn)
-
-
-def smooth_track(track, method=mean):
-    """smooths the track dynamically depending on the distance traveled within the window"""
-    wd = deque(maxlen=10)
-    smoothed_track = []
-    for pt in track:
-        if len(wd) == 10:
-            d_pts = deque(maxlen=2)
-            dist = 0
-            for d_pt in wd:
-                if len(d_pts) == 2:
-                    dist += distance(d_pts)
-                d_pts.append(d_pt)
-            if dist < 10:
-                smoothed_track.append(method(wd))
-            else:
-                smoothed_track += list(wd)
-            wd.clear()
-        wd.append(pt.coords)
-    if 10 >= len(wd) > 0:
-        smoothed_track.append(method(wd))
-    return smoothed_track
+# statistics of a well or video, times in seconds and distances in the unit of px_size
+STATS_DTYPE = np.dtype([('time_outer', np.float64),
+                        ('distance_outer', np.float64),
+                        ('time_inner', np.float64),
+                        ('distance_inner', np.float64),
+                        ('velocity', np.float64),
+                        ('outer_time_percentage', np.float64),
+                        ('outer_distance_percentage', np.float64)])
+# columns written with and without velocity
+VELOCITY_FIELDS = ['time_outer', 'distance_outer', 'time_inner', 'distance_inner', 'velocity']
+PERCENTAGE_FIELDS = ['time_outer', 'distance_outer', 'time_inner', 'distance_inner',
+                     'outer_time_percentage', 'outer_distance_percentage']
+
+
+def track_totals(frames, frame_starts, coords, coord_starts):
+    """frames covered by and distance traveled on every track, computed for all tracks at once
+
+    frames and coords hold the frame numbers and the smoothed coordinates of all tracks one after another,
+    frame_starts and coord_starts the index of the first entry of every track, tracks must not be empty"""
+    # a track covers the frames between its points and one frame for the first point,
+    # steps from the last point of a track to the first point of the next one are removed
+    steps = np.append(np.diff(frames), 0)
+    steps[frame_starts[1:] - 1] = 0
+    track_frames = np.add.reduceat(steps, frame_starts) + 1
+    dists = np.append(np.hypot(*np.diff(coords, axis=0).T), 0)
+    coord_ends = np.append(coord_starts[1:], len(coords))
+    dists[coord_ends - 1] = 0
+    # the distances were summed in a loop over the points that added the step between the two points
+    # before the current one, so the step to the last point was never counted,
+    # the step stays left out so stats.txt keeps its values
+    last_steps = coord_ends - 2
+    dists[last_steps[last_steps >= coord_starts]] = 0
+    track_distances = np.add.reduceat(dists, coord_starts)
+    return track_frames, track_distances
+
+
+def zone_stats(wells, fps=30, px_size=0.006, smoothing='adaptive', window=10, min_distance=10):
+    """statistics of the outer and inner tracks of many wells in one call,
+    wells is a list with the outer and inner track lists of every well,
+    the distances are measured on the tracks smoothed with the filter named smoothing from SMOOTHERS,
+    adaptive keeps the points of blocks moving at least min_distance pixels,
+    returns a STATS_DTYPE array with a row for every well and the smoothed tracks"""
+    frames = []
+    coords = []
+    groups = []
+    smoothed = []
+    options = {'min_distance': min_distance} if smoothing == 'adaptive' else {}
+    for well, zones in enumerate(wells):
+        for zone, tracks in enumerate(zones):
+            for track in tracks:
+                if len(track) == 0:
+                    continue
+                frames.append(track.frame)
+                smoothed.append(SMOOTHERS[smoothing](track.coords, window, **options))
+                coords.append(np.asarray(smoothed[-1], np.float64))
+                # outer and inner region of every well are groups of their own
+                groups.append(2 * well + zone)
+    group_frames = np.zeros(2 * len(wells))
+    group_distances = np.zeros(2 * len(wells))
+    if groups:
+        track_frames, track_distances = track_totals(
+            np.concatenate(frames), np.cumsum([0] + [len(f) for f in frames[:-1]]),
+            np.concatenate(coords), np.cumsum([0] + [len(c) for c in coords[:-1]]))
+        group_frames = np.bincount(groups, track_frames, 2 * len(wells))
+        group_distances = np.bincount(groups, track_distances, 2 * len(wells))
+    times = group_frames.reshape(-1, 2) / fps
+    distances = group_distances.reshape(-1, 2) * px_size
+    stats = np.zeros(len(wells), STATS_DTYPE)
+    stats['time_outer'], stats['time_inner'] = times.T
+    stats['distance_outer'], stats['distance_inner'] = distances.T
+    total_time = times.sum(axis=1)
+    total_distance = distances.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stats['velocity'] = np.where(total_time > 0, total_distance / total_time, np.nan)
+        # the time percentage is undefined if the fish was not found, the distance percentage if it did not move
+        stats['outer_time_percentage'] = np.where(total_time > 0, (times[:, 0] / total_time) * 100, np.nan)
+        stats['outer_distance_percentage'] = np.where(total_distance > 0,
+                                                      (distances[:, 0] / total_distance) * 100, np.nan)
+    return stats, smoothed
+
+
+def write_stats(outfile, iteration, stats):
+    """appends a tab-separated row with the statistics of one well or video to the file"""
+    values = ['NaN' if np.isnan(stats[name]) else str(float(stats[name])) for name in stats.dtype.names]
+    with open(outfile, 'a') as out:
+        out.write(str(iteration) + '\t')
+        out.write('\t'.join(values) + '\n')
 
 
 class Analysis:
     """class contains inner and outer tracks,
     methods for computing the distance and times on tracks
     and to save an image of the tracks"""
-    def __init__(self, outer, inner, fps=30, px_size=0.006):
+    def __init__(self, outer, inner, fps=30, px_size=0.006, smoothing='adaptive', window=10, min_distance=10):
         self.fps = fps
         self.px_size = px_size
+        # name of the smoothing filter in SMOOTHERS and its window in points
+        self.smoothing = smoothing
+        self.window = window
+        # pixels a block of points has to move to be kept by adaptive smoothing
+        self.min_distance = min_distance
         self.outer = outer
         self.inner = inner
         self.tracks = []
@@ -76,10 +132,7 @@ class Analysis:
             r = int(color[0] * 255)
             g = int(color[1] * 255)
             b = int(color[2] * 255)
-            for idx in range(1, len(self.tracks[i])):
-                if self.tracks[i][idx - 1] is None or self.tracks[i][idx] is None:
-                    continue
-                cv2.line(image, self.tracks[i][idx - 1], self.tracks[i][idx], (r, g, b), 1)
+            cv2.polylines(image, [np.int32(self.tracks[i])], False, (r, g, b), 1)
         cv2.imwrite(os.path.join(out_dir, str(iteration) + "_tracks.tiff"), image)
 
     def save_track(self, out_dir, iteration):
@@ -109,84 +162,12 @@ class Analysis:
 
     def analyze(self, outfile, iteration, vel=False):
         """writes information about track to file"""
-        distance_outer = 0
-        distance_inner = 0
-        frames_outer = 0
-        frames_inner = 0
-        # iterate through points on tracks and calculate time
-        # do this for inner and for outer track
-        for track in self.outer:
-            prev_pt = False
-            frames_on_track = 0
-            for pt in track:
-                if not prev_pt:
-                    prev_pt = pt
-                    frames_on_track += 1
-                    continue
-                intermediate_frames = pt.frame - prev_pt.frame
-                frames_on_track += intermediate_frames
-                prev_pt = pt
-            frames_outer += frames_on_track
-            sm_track = smooth_track(track)
-            self.tracks.append(sm_track)
-            pts = deque(maxlen=2)
-            for pt in sm_track:
-                if len(pts) == 2:
-                    distance_outer += distance(pts)
-                pts.append(pt)
-
-        for track in self.inner:
-            prev_pt = False
-            frames_on_track = 0
-            for pt in track:
-                if not prev_pt:
-                    prev_pt = pt
-                    frames_on_track += 1
-                    continue
-                intermediate_frames = pt.frame - prev_pt.frame
-                frames_on_track += intermediate_frames
-                prev_pt = pt
-            frames_inner += frames_on_track
-            sm_track = smooth_track(track)
-            self.tracks.append(sm_track)
-            pts = deque(maxlen=2)
-            for pt in sm_track:
-                if len(pts) == 2:
-                    distance_inner += distance(pts)
-                pts.append(pt)
-
-        distance_outer *= self.px_size
-        distance_inner *= self.px_size
-        time_outer = frames_outer/self.fps
-        time_inner = frames_inner/self.fps
-
-        if vel:
-            try:
-                velocity = (distance_inner + distance_outer) / (time_inner + time_outer)
-            except ZeroDivisionError:
-                velocity = "NaN"
-            # write tab-separated file with values
-            with open(outfile, 'a') as out:
-                out.write(str(iteration) + '\t')
-                out.write(str(time_outer) + '\t')
-                out.write(str(distance_outer) + '\t')
-                out.write(str(time_inner) + '\t')
-                out.write(str(distance_inner) + '\t')
-                out.write(str(velocity) + '\n')
-        else:
-            try:
-                outer_time_percentage = (time_outer / (time_outer + time_inner)) * 100
-                outer_distance_percentage = (distance_outer / (distance_outer + distance_inner)) * 100
-            except ZeroDivisionError:
-                outer_time_percentage = 'NaN'
-                outer_distance_percentage = 'NaN'
-
-            # write tab-separated file with values
-            with open(outfile, 'a') as out:
-                out.write(str(iteration) + '\t')
-                out.write(str(time_outer) + '\t')
-                out.write(str(distance_outer) + '\t')
-                out.write(str(time_inner) + '\t')
-                out.write(str(distance_inner) + '\t')
-                out.write(str(outer_time_percentage) + '\t')
-                out.write(str(outer_distance_percentage) + '\n')
+        write_stats(outfile, iteration, self.stats(vel))
+
+    def stats(self, vel=False):
+        """returns the row of statistics about the tracks written by analyze"""
+        stats, smoothed = zone_stats([(self.outer, self.inner)], self.fps, self.px_size,
+                                     self.smoothing, self.window, self.min_distance)
+        self.tracks += smoothed
+        return stats[VELOCITY_FIELDS if vel else PERCENTAGE_FIELDS][0]
+
@@ -0,0 +1,131 @@
+"""background models for the segmentation of videos, updated one frame at a time"""
+
+import numpy as np
+import cv2
+
+# number of pixels the median projection is computed for at once
+MEDIAN_BLOCK = 65536
+
+
+class MeanBackground:
+    """mean intensity projection from a running sum,
+    memory only depends on the frame size and not on the number of frames"""
+    def __init__(self):
+        self.sum = None
+        self.count = 0
+
+    def update(self, frame):
+        """adds a grayscale frame to the running sum"""
+        if self.sum is None:
+            self.sum = np.zeros(frame.shape, np.float64)
+        self.sum += frame
+        self.count += 1
+
+    def merge(self, other):
+        """adds the frames of another model, e.g. built from a different part of the video"""
+        if self.sum is None:
+            self.sum = other.sum
+        elif other.sum is not None:
+            self.sum += other.sum
+        self.count += other.count
+
+    def get(self):
+        """returns the mean of all frames added so far"""
+        return self.sum / self.count
+
+
+class MedianBackground:
+    """exact median intensity projection of uint8 frames from per-pixel 256-bin histograms,
+    computed in a single pass with fixed memory"""
+    def __init__(self):
+        self.hist = None
+        self.offsets = None
+        self.shape = None
+        self.count = 0
+
+    def update(self, frame):
+        """adds a grayscale uint8 frame to the histograms"""
+        if self.hist is None:
+            self.shape = frame.shape
+            self.hist = np.zeros(frame.size * 256, np.uint32)
+            # position of the first bin of every pixel in the flat histogram array
+            self.offsets = np.arange(frame.size, dtype=np.intp) * 256
+        # every pixel hits a different histogram, so no bin is incremented twice
+        self.hist[self.offsets + frame.ravel()] += 1
+        self.count += 1
+
+    def __getstate__(self):
+        # models of chunks are sent back from worker processes, bins fit in 16 bits for less than 65536 frames
+        state = dict(self.__dict__)
+        if self.hist is not None and self.count < 2 ** 16:
+            state['hist'] = self.hist.astype(np.uint16)
+        state['offsets'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.hist is not None:
+            self.hist = self.hist.astype(np.uint32, copy=False)
+            self.offsets = np.arange(self.hist.size // 256, dtype=np.intp) * 256
+
+    def merge(self, other):
+        """adds the frames of another model, e.g. built from a different part of the video"""
+        if self.hist is None:
+            self.hist = other.hist
+            self.offsets = other.offsets
+            self.shape = other.shape
+        elif other.hist is not None:
+            self.hist += other.hist
+        self.count += other.count
+
+    def get(self):
+        """returns the median of all frames added so far,
+        computed for blocks of MEDIAN_BLOCK pixels, so the cumulative histograms stay small"""
+        hist = self.hist.reshape(-1, 256)
+        median = np.empty(len(hist))
+        cumulative = np.empty((min(MEDIAN_BLOCK, len(hist)), 256), np.uint32)
+        for start in range(0, len(hist), MEDIAN_BLOCK):
+            block = hist[start:start + MEDIAN_BLOCK]
+            np.cumsum(block, axis=1, dtype=np.uint32, out=cumulative[:len(block)])
+            # for even counts the median is the mean of the two middle values
+            lower = np.argmax(cumulative[:len(block)] > (self.count - 1) // 2, axis=1)
+            upper = np.argmax(cumulative[:len(block)] > self.count // 2, axis=1)
+            median[start:start + len(block)] = (lower + upper) / 2
+        return median.reshape(self.shape)
+
+
+class RollingBackground:
+    """background that follows slow changes of the lighting, updated one frame at a time,
+    memory only depends on the frame size
+
+    the exponential mean weights a frame with 1 / tau, the approximate median moves every pixel
+    by at most 128 / tau gray values towards the frame, so both forget the frames with a time constant
+    of about tau frames, during the first tau frames they average over all frames so far"""
+    def __init__(self, tau=1500, median=False):
+        # time constant in frames
+        self.tau = tau
+        self.median = median
+        self.background = None
+        self.step = None
+        self.count = 0
+
+    def update(self, frame):
+        """moves the background towards a grayscale frame"""
+        if self.background is None:
+            self.background = frame.astype(np.float32)
+            self.step = np.empty_like(self.background)
+            self.count = 1
+            return
+        self.count = min(self.count + 1, self.tau)
+        if self.median:
+            # the median moves by a fixed step in the direction of the frame
+            np.subtract(frame, self.background, out=self.step)
+            np.sign(self.step, out=self.step)
+            self.step *= 128 / self.count
+            self.background += self.step
+        else:
+            cv2.accumulateWeighted(frame, self.background, 1 / self.count)
+
+    def get(self):
+        """returns the current background, valid until the next update"""
+        return self.background
@@ -1,181 +1,685 @@
 from skimage.external import tifffile
 import numpy as np
 import cv2
-import imageio
+import os
+import pickle
 from collections import deque
+from multiprocessing import Pool
 
+from zftracking.external.runffmpeg import FfmpegReader
+from zftracking.external.runffmpeg import FrameIndex
+from zftracking.tracking.background import MeanBackground
+from zftracking.tracking.background import MedianBackground
+from zftracking.tracking.background import RollingBackground
+from zftracking.tracking.track_store import Point
+from zftracking.tracking.track_store import TrackStore
+from zftracking.tracking.track_store import spot_score
+from zftracking.tracking.track_store import concatenate
+from zftracking.tracking.track_store import split_ranges
+
+# structuring element of the closing of the spot masks
+CLOSE_KERNEL = np.ones((3, 3), np.uint8)
+# side length of the blocks of pixels averaged before checking frames for motion
+MOTION_SCALE = 4
+# attributes of a Video saved in checkpoints of a rolling pass
+CHECKPOINT_STATE = ('counter', 'pts', 'previous', 'skipped_frames', 'gated_frames', 'segmenter', 'coarse', 'motion')
+# attributes a checkpoint is only continued from when they are the same
+CHECKPOINT_KEY = ('path', 'crop', 'start', 'end', 'median', 'components', 'gate', 'pyramid', 'rolling')
+
+
+def crop_box(crop):
+    """translates a ffmpeg crop string (width:height:x:y) to array slices"""
+    width, height, x, y = (int(v) for v in crop.split(':'))
+    return slice(y, y + height), slice(x, x + width)
+
+
+def well_labels(shape, crops):
+    """label image of the wells, pixels inside the crop of well i are i + 1, pixels outside of all wells 0,
+    where crops overlap the later well wins"""
+    labels = np.zeros(shape, np.int32)
+    for idx, crop in enumerate(crops):
+        labels[crop_box(crop)] = idx + 1
+    return labels
+
+
+def spot_mask(diff, dst=None):
+    """binary mask of the spots in a saturated difference image,
+    thresholded in place and closed (dilated and eroded) in one step into dst"""
+    cv2.threshold(diff, 0, 255, cv2.THRESH_BINARY, dst=diff)
+    return cv2.morphologyEx(diff, cv2.MORPH_CLOSE, CLOSE_KERNEL, dst=dst)
+
+
+class Segmenter:
+    """segments grayscale uint8 frames against a background,
+    pixels darker than the blurred background by more than 30 gray values are spots
+
+    the segmentation stays in uint8 with saturating subtraction and writes into buffers
+    allocated once, so frames of the full size allocate no memory
+
+    with rolling, the background is a RollingBackground of the blurred frames with a time constant
+    of rolling frames, seeded with avg and moved with update after every frame"""
+    def __init__(self, avg, sigma=3, rolling=0, median=False):
+        self.sigma = sigma
+        # the gaussian blur reaches less than 4 sigma
+        self.margin = int(np.ceil(4 * sigma))
+        blurred = cv2.GaussianBlur(avg, (0, 0), sigma)
+        # the background is floored, for integer frames the saturated difference is then positive
+        # for exactly the pixels where the difference to the float background is at least 1
+        self.background = np.clip(np.floor(blurred - 30), 0, 255).astype(np.uint8)
+        self.blurred = np.empty_like(self.background)
+        self.diff = np.empty_like(self.background)
+        self.mask = np.empty_like(self.background)
+        # whether the blurred buffer holds the whole frame segmented last
+        self.current = False
+        self.model = None
+        if rolling:
+            self.model = RollingBackground(rolling, median)
+            self.model.update(blurred)
+            self.levels = np.empty(self.background.shape, np.float32)
+
+    def difference(self, frame):
+        """saturated difference between background and blurred frame, valid until the next call"""
+        cv2.GaussianBlur(frame, (0, 0), self.sigma, dst=self.blurred)
+        self.current = True
+        return cv2.subtract(self.background, self.blurred, dst=self.diff)
+
+    def update(self, frame):
+        """moves the rolling background towards the frame segmented last"""
+        if not self.current:
+            cv2.GaussianBlur(frame, (0, 0), self.sigma, dst=self.blurred)
+        self.current = False
+        self.model.update(self.blurred)
+        # floor and clip like the static background, truncation floors the clipped levels
+        np.subtract(self.model.get(), 30, out=self.levels)
+        np.clip(self.levels, 0, 255, out=self.levels)
+        self.background[...] = self.levels
+
+    def __call__(self, frame, window=None):
+        """returns the mask with the spots of the frame, valid until the next call,
+        only of the window if one is given"""
+        if window is None:
+            return spot_mask(self.difference(frame), self.mask)
+        # blur a margin around the window, so the blurred window is the same as in the blurred frame
+        outer = grow_window(window, self.margin, frame.shape)
+        rows, cols = window
+        blurred = cv2.GaussianBlur(frame[outer], (0, 0), self.sigma)
+        blurred = blurred[rows.start - outer[0].start:rows.stop - outer[0].start,
+                          cols.start - outer[1].start:cols.stop - outer[1].start]
+        return spot_mask(cv2.subtract(self.background[window], blurred))
+
+
+def downsample(frame, scale):
+    """shrinks a frame by an integer scale, averaging blocks of scale x scale pixels"""
+    size = (max(frame.shape[1] // scale, 1), max(frame.shape[0] // scale, 1))
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+
+def contour_spots(contours):
+    """centers and areas of the contours as arrays, contours without area are dropped"""
+    moments = np.array([[m['m00'], m['m10'], m['m01']] for m in map(cv2.moments, contours)]).reshape(-1, 3)
+    moments = moments[moments[:, 0] > 0]
+    # centers are truncated to whole pixels
+    centers = (moments[:, 1:] / moments[:, :1]).astype(np.int64)
+    return centers, moments[:, 0]
+
+
+def component_spots(mask):
+    """centers and areas of the spots in a binary mask from a single connected components call"""
+    count, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    # label 0 is the background, centers are truncated to whole pixels like the contour centers
+    return centroids[1:].astype(np.int64), stats[1:, cv2.CC_STAT_AREA].astype(np.float64)
+
+
+def find_spots(mask, components=False):
+    """centers and areas of the spots in a binary mask, from connected components or from contours
+
+    connected components count pixels and contours measure the outline polygon,
+    so areas and centers differ slightly between the two"""
+    if components:
+        return component_spots(mask)
+    contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+    return contour_spots(contours)
+
+
+def best_spot(centers, areas, frame, previous=None, norm_area=80, a_weight=1):
+    """scores all spots against the previous point and returns the best one as Point,
+    without a previous point the largest spot is taken, None if there are no spots"""
+    if len(areas) == 0:
+        return None
+    if previous is None:
+        idx = int(np.argmax(areas))
+    else:
+        distances = np.hypot(centers[:, 0] - previous.coords[0], centers[:, 1] - previous.coords[1])
+        scores = spot_score(areas, distances, norm_area, a_weight)
+        # on equal scores the last spot wins, like sorting the spots did
+        idx = len(scores) - 1 - int(np.argmax(scores[::-1]))
+    return Point((int(centers[idx, 0]), int(centers[idx, 1])), float(areas[idx]), frame, previous,
+                 norm_area=norm_area, a_weight=a_weight)
+
+
+def predict_window(pts, frame, shape, size):
+    """square search window of half width size around the position in frame predicted with constant
+    velocity from the last two points, None if the last point is not from the previous frame"""
+    if size <= 0 or len(pts) == 0 or pts.frame[-1] != frame - 1:
+        return None
+    x, y = int(pts.x[-1]), int(pts.y[-1])
+    if len(pts) > 1 and pts.frame[-2] == frame - 2:
+        x, y = 2 * x - int(pts.x[-2]), 2 * y - int(pts.y[-2])
+    # keep the prediction inside the frame
+    x = min(max(x, 0), shape[1] - 1)
+    y = min(max(y, 0), shape[0] - 1)
+    return grow_window((slice(y, y + 1), slice(x, x + 1)), size, shape)
+
+
+def grow_window(window, margin, shape):
+    """adds a margin to all sides of a window of array slices, clipped to the frame"""
+    rows, cols = window
+    return (slice(max(rows.start - margin, 0), min(rows.stop + margin, shape[0])),
+            slice(max(cols.start - margin, 0), min(cols.stop + margin, shape[1])))
+
+
+def touches_border(mask, window, shape):
+    """whether spots in the mask of a window touch a side of the window that is not a side of the frame"""
+    rows, cols = window
+    return bool((rows.start > 0 and mask[0].any()) or (rows.stop < shape[0] and mask[-1].any()) or
+                (cols.start > 0 and mask[:, 0].any()) or (cols.stop < shape[1] and mask[:, -1].any()))
+
+
+def gated_spots(segment, shape, window=None, components=False, full=None):
+    """centers and areas of the spots in the mask segment returns for the window,
+    the full frame is searched if there is no window, no spot in it or a spot is cut by its border,
+    also returns whether the search stayed inside the window
+
+    full can search the full frame faster, e.g. with pyramid_spots, and returns None when it fails"""
+    if window is not None:
+        mask = segment(window)
+        centers, areas = find_spots(mask, components)
+        if len(areas) > 0 and not touches_border(mask, window, shape):
+            return centers + (window[1].start, window[0].start), areas, True
+    if full is not None:
+        spots = full()
+        if spots is not None:
+            return spots[0], spots[1], False
+    centers, areas = find_spots(segment(None), components)
+    return centers, areas, False
+
+
+def candidate_windows(mask, scale, shape, margin=2):
+    """full resolution windows around the spots of a mask downsampled by scale,
+    the windows reach margin coarse pixels beyond the spots and overlapping windows are merged"""
+    count, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    boxes = [[(y - margin) * scale, (y + h + margin) * scale, (x - margin) * scale, (x + w + margin) * scale]
+             for x, y, w, h in stats[1:, :4].tolist()]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[0] < b[1] and b[0] < a[1] and a[2] < b[3] and b[2] < a[3]:
+                    boxes[i] = [min(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3])]
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return [(slice(max(top, 0), min(bottom, shape[0])), slice(max(left, 0), min(right, shape[1])))
+            for top, bottom, left, right in boxes]
+
+
+def refine_spots(segment, shape, windows, components=False):
+    """centers and areas of the spots segment finds in the full resolution windows,
+    None if a spot is cut by the border of a window"""
+    centers = [np.zeros((0, 2), np.int64)]
+    areas = [np.zeros(0)]
+    for window in windows:
+        mask = segment(window)
+        if touches_border(mask, window, shape):
+            return None
+        window_centers, window_areas = find_spots(mask, components)
+        centers.append(window_centers + (window[1].start, window[0].start))
+        areas.append(window_areas)
+    return np.concatenate(centers), np.concatenate(areas)
 
-class Point:
-    """class to store points on tracks, keeps track of the last detected point to calculate distance"""
-    def __init__(self, coords, area, frame, prev=None):
-        # coordinates of the center of the detected spot
-        self.coords = coords
-        # area of the detected spot
-        self.area = area
-        # standard area for score calculation
-        self.norm_area = 80
-        # frame in video
-        self.frame = frame
-        # if point is first on track, skip distance calculation
-        if not prev:
-            self.score = None
-            self.distance = None
-        else:
-            x_dist = self.coords[0] - prev.coords[0]
-            y_dist = self.coords[1] - prev.coords[1]
-            self.distance = np.sqrt(x_dist**2 + y_dist**2)
-            # score is calculated from area of spot and distance to previous point
-            self.score = (1 * (1 - abs(self.norm_area - self.area)))+(1 - 2 * self.distance)
 
-    # functions to make sorting of spots by score possible
-    def __repr__(self):
-        return "Point at %i:%i" % self.coords
+class MotionGate:
+    """finds frames without motion from the absolute difference to the last frame that was segmented,
+    both frames are downsampled by MOTION_SCALE first, which also averages out noise"""
+    def __init__(self, threshold=0):
+        # largest difference in gray values of a frame without motion, 0 disables the gate
+        self.threshold = threshold
+        self.reference = None
+        # number of frames without motion
+        self.gated = 0
 
-    def __lt__(self, other):
-        return self.score < other.score
+    def still(self, frame):
+        """whether the frame has no motion, otherwise it becomes the reference for the next frames"""
+        if not self.threshold:
+            return False
+        small = downsample(frame, MOTION_SCALE)
+        if self.reference is not None and cv2.norm(small, self.reference, cv2.NORM_INF) <= self.threshold:
+            self.gated += 1
+            return True
+        self.reference = small
+        return False
 
-    def __le__(self, other):
-        return self.score <= other.score
 
-    def __gt__(self, other):
-        return self.score > other.score
+def split_chunks(nframes, chunks, start=0):
+    """splits nframes frames beginning at start into chunks of about equal length"""
+    bounds = [start + nframes * i // chunks for i in range(chunks + 1)]
+    return [(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
 
-    def __ge__(self, other):
-        return self.score >= other.score
 
-    def __eq__(self, other):
-        return self.score == other.score
+def chunk_background(params):
+    """builds the background model of a chunk of a video, runs in a worker process"""
+    path, crop, median, start, end = params
+    vid = Video(path, crop=crop, median=median, start=start, end=end)
+    background = vid.background_model()
+    for frame in vid.frames():
+        background.update(frame)
+    return background
 
-    def __ne__(self, other):
-        return self.score != other.score
+
+def stall_report(reader):
+    """waits of the decoder thread and the tracker on each other, they show which one is the bottleneck,
+    empty if the reader decoded on demand"""
+    if reader is None or not reader.prefetch:
+        return ""
+    return "decoder waited %i times, tracker waited %i times" % (reader.decoder_stalls, reader.tracker_stalls)
+
+
+def chunk_track(params):
+    """tracks a chunk of a video, runs in a worker process
+
+    tracking starts up to overlap frames before the chunk, so the previous point is known
+    at its first frame, only the points inside the chunk are returned, together with the number of frames
+    of the chunk without motion and searched only in the window"""
+    path, crop, avg, start, end, overlap, first, components, gate, motion, pyramid = params
+    vid = Video(path, crop=crop, start=max(start - overlap, first), end=end, components=components, gate=gate,
+                motion=motion, pyramid=pyramid)
+    vid.set_background(avg)
+    for frame in vid.frames():
+        if vid.counter == start:
+            # the frames before the chunk are counted by the chunk they belong to
+            vid.motion.gated = 0
+            vid.gated_frames = 0
+        vid.process(frame)
+    return vid.pts[vid.pts.frame >= start], vid.motion.gated, vid.gated_frames
+
+
+class Plate:
+    """decodes a multi-well video once and slices every frame into the wells"""
+
+    def __init__(self, path, crops, prefetch=0, start=None, end=None):
+        self.path = path
+        # range of frames to decode, end is exclusive
+        self.start = start
+        self.end = end
+        # number of frames decoded ahead in a background thread
+        self.prefetch = prefetch
+        # reader of the last pass over the video, holds the stall counters
+        self.reader = None
+        # ffmpeg compliant crop strings of the wells, as returned by interactive_crop
+        self.crops = crops
+        self.boxes = [crop_box(crop) for crop in crops]
+        # trackers of the wells in the last call of track, they hold the counters of the wells
+        self.videos = []
+
+    def frames(self):
+        """yields the grayscale frames of the whole plate"""
+        self.reader = FfmpegReader(self.path, prefetch=self.prefetch, start=self.start, end=self.end)
+        return iter(self.reader)
+
+    def track(self, median=False, components=False, wide=False, gate=0, motion=0, pyramid=1, rolling=0):
+        """tracks all wells and returns a list with the tracks of every well
+
+        the wells of every decoded frame are fed to their trackers right away, so no well is held in memory,
+        the first pass builds the backgrounds, the second one tracks the wells,
+        with rolling, a single pass starts the backgrounds from the first frame,
+        with wide, the whole plate is segmented at once, see track_wide,
+        which does not use gate, motion, pyramid and rolling"""
+        if wide:
+            return self.track_wide(median, components)
+        videos = [Video(median=median, start=self.start, components=components, gate=gate, motion=motion,
+                        pyramid=pyramid, rolling=rolling)
+                  for _ in self.boxes]
+        self.videos = videos
+        if not rolling:
+            backgrounds = [vid.background_model() for vid in videos]
+            for frame in self.frames():
+                for background, (rows, cols) in zip(backgrounds, self.boxes):
+                    background.update(frame[rows, cols])
+            for vid, background in zip(videos, backgrounds):
+                vid.set_background(background.get())
+        for frame in self.frames():
+            for vid, (rows, cols) in zip(videos, self.boxes):
+                if vid.segmenter is None:
+                    vid.set_background(frame[rows, cols].astype(np.float64))
+                vid.process(frame[rows, cols])
+        return [vid.split_tracks() for vid in videos]
+
+    def track_wide(self, median=False, components=False):
+        """tracks all wells with a single blur, background subtraction and spot search per plate frame
+
+        spots are assigned to the wells with a label image of the crops, so the cost per frame
+        hardly grows with the number of wells, the plate is decoded twice like with big,
+        the blur of the whole plate reaches across the edges of the wells, so spots near the edges
+        can differ from the spots found in the wells separately"""
+        background = MedianBackground() if median else MeanBackground()
+        for frame in self.frames():
+            background.update(frame)
+        segmenter = Segmenter(background.get())
+        labels = well_labels(segmenter.background.shape, self.crops)
+        # upper left corner of every well, the points are stored relative to their well
+        offsets = np.array([(cols.start, rows.start) for rows, cols in self.boxes])
+        videos = [Video(start=self.start) for _ in self.boxes]
+        self.videos = videos
+        # last point of every well and whether the well has one yet
+        previous = np.zeros((len(self.boxes), 2))
+        found = np.zeros(len(self.boxes), bool)
+        for counter, frame in enumerate(self.frames(), self.start or 0):
+            centers, areas = find_spots(segmenter(frame), components)
+            # well of every spot from its center, spots outside of all wells are dropped
+            wells = labels[centers[:, 1], centers[:, 0]] - 1
+            inside = wells >= 0
+            wells = wells[inside]
+            if len(wells) == 0:
+                continue
+            centers = centers[inside] - offsets[wells]
+            areas = areas[inside]
+            distances = np.hypot(centers[:, 0] - previous[wells, 0], centers[:, 1] - previous[wells, 1])
+            scores = spot_score(areas, distances)
+            # like best_spot: the best score wins, the last one on ties,
+            # wells without a previous point take their first largest spot
+            spots = np.arange(len(wells))
+            order = np.lexsort((np.where(found[wells], spots, -spots),
+                                np.where(found[wells], scores, areas),
+                                wells))
+            # the last spot of every well in the order is the winner
+            winners = order[np.append(wells[order][1:] != wells[order][:-1], True)]
+            for idx in winners:
+                well = wells[idx]
+                if found[well]:
+                    videos[well].pts.append(counter, centers[idx, 0], centers[idx, 1], areas[idx],
+                                            scores[idx], distances[idx])
+                else:
+                    videos[well].pts.append(counter, centers[idx, 0], centers[idx, 1], areas[idx])
+            previous[wells[winners]] = centers[winners]
+            found[wells[winners]] = True
+        return [vid.split_tracks() for vid in videos]
+
+    def report(self):
+        """counters of the last decoding pass over the plate, empty if there are none"""
+        return stall_report(self.reader)
 
 
 class Video:
     """stores the video file and contains tracking method"""
 
-    def __init__(self, path):
-        # dictionary for points on the track
-        # 'key' is the frame of the video; 'value' is a Point object
-        self.pts = {}
+    def __init__(self, path=None, big=False, median=False, crop=None, prefetch=0,
+                 start=None, end=None, chunks=1, overlap=50, components=False, gate=0, gap=25, min_length=10,
+                 motion=0, pyramid=1, rolling=0, checkpoint=None, checkpoint_every=15000):
+        # columnar store of the detected points, in the order of the frames
+        self.pts = TrackStore()
+        # range of frames to decode, end is exclusive
+        self.start = start or 0
+        self.end = end
         # counts the frame in the video
-        self.counter = 0
-        # bool for special case on first frame
-        self.previous_frame = None
-        # read the avi file
-        self.video = imageio.get_reader(path, 'ffmpeg')
-        # tracks is a list with lists for the individual track points
-        self.tracks = [[]]
+        self.counter = self.start
+        # last detected Point, None before the first detection
+        self.previous = None
+        self.path = path
+        # ffmpeg compliant crop string, only the cropped region is decoded
+        self.crop = crop
+        # number of frames decoded ahead in a background thread
+        self.prefetch = prefetch
+        # reader of the last pass over the video, holds the stall counters
+        self.reader = None
+        # with big, frames are not kept in memory but read twice from the file
+        self.big = big
+        # use the median instead of the mean intensity projection as background
+        self.median = median
+        # number of parts of the video tracked in parallel processes
+        self.chunks = chunks
+        # frames tracked before each chunk to pick up the track of the previous chunk
+        self.overlap = overlap
+        # find spots with connected components instead of contours
+        self.components = components
+        # half width of the search window around the predicted position, 0 always searches the whole frame
+        self.gate = gate
+        # number of frames searched only inside the window
+        self.gated_frames = 0
+        # frames differing by at most motion gray values from the last segmented frame keep the last detection
+        self.motion = MotionGate(motion)
+        # tracks are split at gaps of more than gap frames, shorter tracks than min_length are removed
+        self.gap = gap
+        self.min_length = min_length
+        # start and end index of every track in the point store
+        self.ranges = np.zeros((0, 2), np.int64)
+        # tracks is a list with views on the point store for the individual tracks
+        self.tracks = []
         self.skipped_frames = 0
         self.segmentation = None
+        # segments the frames against the background
+        self.segmenter = None
+        # spots are searched on frames downsampled by pyramid first and only measured in full resolution
+        # in windows around them, 1 searches the full resolution frame
+        self.pyramid = pyramid
+        self.coarse = None
+        # time constant in frames of the rolling background, 0 uses one projection of the whole video
+        self.rolling = rolling
+        # file the state of a rolling pass is saved to every checkpoint_every frames, a pass with the
+        # same video, crop and tracking parameters continues from it
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+
+    def frames(self, start=None):
+        """yields the grayscale frames of the video beginning at start, the file is read again on every call
+
+        frames read from the file share one buffer and have to be copied to be kept"""
+        if start is None:
+            start = self.start
+        self.reader = FfmpegReader(self.path, crop=self.crop, prefetch=self.prefetch,
+                                   start=start, end=self.end)
+        return iter(self.reader)
+
+    def load(self):
+        """returns a list with all grayscale frames of the video"""
+        return [frame.copy() for frame in self.frames()]
+
+    def background_model(self):
+        """returns an empty background model for the median or mean intensity projection"""
+        if self.median:
+            return MedianBackground()
+        return MeanBackground()
+
+    def project(self, frames):
+        """returns the intensity projection of the frames, one frame is added at a time"""
+        background = self.background_model()
+        for frame in frames:
+            background.update(frame)
+        return background.get()
+
+    def set_background(self, avg):
+        """sets the intensity projection used for background subtraction, with rolling the first background"""
+        self.segmenter = Segmenter(avg, rolling=self.rolling, median=self.median)
+        if self.pyramid > 1:
+            # the blur of the coarse level covers about the same area as the one in full resolution
+            self.coarse = Segmenter(downsample(avg, self.pyramid), 3 / self.pyramid, self.rolling, self.median)
+
+    def pyramid_spots(self, frame):
+        """finds the spots on the downsampled frame and measures them in full resolution windows around them,
+        None if a spot is cut by a window"""
+        windows = candidate_windows(self.coarse(downsample(frame, self.pyramid)), self.pyramid, frame.shape)
+        return refine_spots(lambda w: self.segmenter(frame, w), frame.shape, windows, self.components)
 
     def segment(self):
         """method to segment video"""
-        frames = []
-        for i, frame in enumerate(self.video):
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
-            frames.append(frame)
-        frames = np.array(frames)
-        avg = frames.mean(axis=0)
-        avg_blur = cv2.GaussianBlur(avg, (0, 0), 3)
+        frames = self.load()
+        self.set_background(self.project(frames))
         segmentation = []
         cv2.startWindowThread()
         cv2.namedWindow("segmentation")
         for frame in frames:
-            sub = (avg_blur - 30) - cv2.GaussianBlur(frame, (0, 0), 3)
+            sub = self.segmenter.difference(frame).copy()
             segmentation.append(sub)
             cv2.imshow("segmentation", sub)
             cv2.waitKey(1)
         self.segmentation = np.array(segmentation)
 
-    def track(self):
+    def track(self, out_path=None):
         """method to track spots in the video"""
-        empty = None
-        frames = []
-        frames_bw = []
-        for i, frame in enumerate(self.video):
-            if empty is None:
-                empty = np.zeros(frame.shape, np.uint8)
-            frame_bw = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
-            frames.append(frame)
-            frames_bw.append(frame_bw)
-        frames_bw = np.array(frames_bw)
-        avg = frames_bw.mean(axis=0)
-        avg_blur = cv2.GaussianBlur(avg, (0, 0), 3)
-        for idx in range(len(frames_bw)):
-            frame = frames_bw[idx]
-            sub = (avg_blur - 30) - cv2.GaussianBlur(frame, (0, 0), 3)
-            # iterate over frames in video
-            if np.array_equal(empty, sub):
-                # skip empty frames
-                self.counter += 1
+        if self.rolling:
+            self.track_rolling()
+        elif self.chunks > 1:
+            self.track_chunks()
+        else:
+            if self.big:
+                # first pass: accumulate the background, second pass: track frame by frame
+                self.set_background(self.project(self.frames()))
+                frames = self.frames()
+            else:
+                frames = self.load()
+                self.set_background(self.project(frames))
+            for frame in frames:
+                self.process(frame)
+        self.split_tracks()
+        if out_path:
+            self.save_tracks(out_path)
+        return self.tracks
+
+    def track_chunks(self):
+        """tracks chunks of the video in parallel processes and stitches their points
+
+        the chunk backgrounds are merged into the background of the whole video,
+        the stitched points are split into tracks like the points of a single pass"""
+        end = self.end
+        if end is None:
+            end = FrameIndex(self.path).nframes
+        chunks = split_chunks(end - self.start, self.chunks, self.start)
+        with Pool(len(chunks)) as pool:
+            backgrounds = pool.map(chunk_background,
+                                   [(self.path, self.crop, self.median, a, b) for a, b in chunks])
+            background = backgrounds[0]
+            for other in backgrounds[1:]:
+                background.merge(other)
+            avg = background.get()
+            self.set_background(avg)
+            parts = pool.map(chunk_track,
+                             [(self.path, self.crop, avg, a, b, self.overlap, self.start, self.components, self.gate,
+                               self.motion.threshold, self.pyramid)
+                              for a, b in chunks])
+        points, still, gated = zip(*parts)
+        self.pts = concatenate(points)
+        self.motion.gated = sum(still)
+        self.gated_frames = sum(gated)
+        self.counter = end
+
+    def track_rolling(self):
+        """tracks the video in a single pass, the background starts from the first frame and follows it
+        with the time constant rolling, chunks are not used as every frame depends on the frames before"""
+        self.load_checkpoint()
+        last = FrameIndex(self.path).nframes
+        if self.end is not None:
+            last = min(self.end, last)
+        # a checkpoint saved at the last frame has nothing left to track
+        if self.counter < last:
+            for frame in self.frames(self.counter):
+                if self.segmenter is None:
+                    self.set_background(frame.astype(np.float64))
+                self.process(frame)
+                if self.checkpoint and (self.counter - self.start) % self.checkpoint_every == 0:
+                    self.save_checkpoint()
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+
+    def save_checkpoint(self):
+        """saves the state of the tracking pass, the file is replaced at once, so it stays readable
+        if the process is stopped while writing"""
+        state = {name: getattr(self, name) for name in CHECKPOINT_STATE}
+        state['key'] = self.checkpoint_key()
+        with open(self.checkpoint + '.tmp', 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(self.checkpoint + '.tmp', self.checkpoint)
+
+    def load_checkpoint(self):
+        """continues from the saved state of an interrupted pass over the same video and crop
+        with the same tracking parameters, other checkpoints are ignored"""
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return
+        with open(self.checkpoint, 'rb') as f:
+            state = pickle.load(f)
+        if state.pop('key', None) == self.checkpoint_key():
+            self.__dict__.update(state)
+
+    def checkpoint_key(self):
+        """parameters of the pass that have to match to continue from a checkpoint"""
+        return tuple(getattr(self, name) for name in CHECKPOINT_KEY) + (self.motion.threshold,)
+
+    def report(self):
+        """counters of the last tracking pass, empty if there are none"""
+        counters = []
+        if self.motion.threshold:
+            counters.append("skipped %i of %i frames without motion" % (self.motion.gated, self.counter - self.start))
+        if self.gate:
+            counters.append("searched %i of %i frames only around the predicted position"
+                            % (self.gated_frames, self.counter - self.start))
+        counters.append(stall_report(self.reader))
+        return ", ".join(counter for counter in counters if counter)
+
+    def process(self, frame):
+        """finds the spot in a single grayscale frame and adds it to the points dictionary"""
+        if self.motion.still(frame):
+            # nothing moved, the spot stays where it was if it was found in the frame before
+            if self.previous is not None and self.previous.frame == self.counter - 1:
+                self.previous = Point(self.previous.coords, self.previous.area, self.counter, self.previous)
+                self.pts.append_point(self.previous)
+            elif self.previous is not None:
+                # the larva was already missing before nothing moved
                 self.skipped_frames += 1
-                print(self.skipped_frames)
-                continue
-            # create mask with the detected spots from the frame
-            mask = cv2.inRange(sub, 1, 256)
-            mask = cv2.dilate(mask, None, iterations=1)
-            mask = cv2.erode(mask, None, iterations=1)
-            # find contours in the video
-            contours = cv2.findContours(mask.copy(),
-                                        cv2.RETR_EXTERNAL,
-                                        cv2.CHAIN_APPROX_SIMPLE)[-2]
-            if len(contours) > 0:
-                if self.previous_frame is None:
-                    # for the first frame in the video, just find the largest contour in the mask
-                    c = max(contours, key=cv2.contourArea)
-                    # compute center point
-                    m = cv2.moments(c)
-                    try:
-                        center = (int(m["m10"] / m["m00"]), int(m["m01"] / m["m00"]))
-                    except ZeroDivisionError:
-                        continue
-                    # add point to the points dictionary
-                    self.pts[self.counter] = Point(center, cv2.contourArea(c), self.counter)
-                    self.previous_frame = self.counter
-                else:
-                    # make a list of possible spots and choose the one with the highest score
-                    candidate_pts = []
-                    for c in contours:
-                        m = cv2.moments(c)
-                        try:
-                            center = (int(m["m10"] / m["m00"]), int(m["m01"] / m["m00"]))
-                        except ZeroDivisionError:
-                            continue
-                        candidate_pts.append(Point(center,
-                                                   cv2.contourArea(c),
-                                                   self.counter,
-                                                   self.pts[self.previous_frame]))
-                    if len(candidate_pts) >= 1:
-                        # add the best spot to the points dictionary
-                        c = sorted(candidate_pts)[-1]
-                        self.pts[self.counter] = c
-                        self.previous_frame = self.counter
-                    else:
-                        self.skipped_frames += 1
             self.counter += 1
+            return
+        # with gate, search around the position predicted from the last points first
+        window = predict_window(self.pts, self.counter, frame.shape, self.gate)
+        full = None
+        if self.coarse is not None:
+            full = lambda: self.pyramid_spots(frame)
+        centers, areas, gated = gated_spots(lambda w: self.segmenter(frame, w), frame.shape, window,
+                                            self.components, full)
+        self.gated_frames += gated
+        if self.rolling:
+            self.segmenter.update(frame)
+            if self.coarse is not None:
+                self.coarse.update(downsample(frame, self.pyramid))
+        # score all spots at once and add the best one to the point store
+        spot = best_spot(centers, areas, self.counter, self.previous)
+        if spot is not None:
+            self.previous = spot
+            self.pts.append_point(spot)
+        elif self.previous is not None:
+            # no spot found after the first detection
+            self.skipped_frames += 1
+        self.counter += 1
 
-        # after finding all spots, split tracks with gaps of more than 25 frames
-        prev_key = 0
-        curr_track = 0
-        for key in sorted(self.pts):
-            if (key - prev_key) > 25:
-                self.tracks.append([])
-                curr_track += 1
-            self.tracks[curr_track].append(self.pts[key])
-            prev_key = key
-
-        # delete tracks with less than 10 points
-        tracks = [t for t in self.tracks if len(t) >= 10]
-        self.tracks = tracks
-        if out_path:
-            for track in self.tracks:
-                pts = deque(maxlen=300)
-                for pt in track:
-                    for idx in range(1, len(pts)):
-                        if pts[idx - 1] is None or pts[idx] is None:
-                            continue
-                        cv2.line(self.video[pt.frame], pts[idx - 1].coords, pts[idx].coords, 255, 1)
-                    pts.append(pt)
-            tifffile.imsave(out_path, self.video)
-
+    def split_tracks(self):
+        """splits the points into tracks at gaps of more than gap frames and removes tracks
+        with less than min_length points, every track is a view on the point store"""
+        self.ranges = split_ranges(self.pts.frame, self.gap, self.min_length)
+        self.tracks = [self.pts[a:b] for a, b in self.ranges]
         return self.tracks
+
+    def save_tracks(self, out_path):
+        """draws the tracks onto the frames and writes them to a tiff stack, one frame at a time"""
+        lines = {}
+        for track in self.tracks:
+            pts = deque(maxlen=300)
+            for pt in track:
+                for idx in range(1, len(pts)):
+                    lines.setdefault(pt.frame, []).append((pts[idx - 1].coords, pts[idx].coords))
+                pts.append(pt)
+        with tifffile.TiffWriter(out_path, bigtiff=True) as tif:
+            for idx, frame in enumerate(self.frames(), self.start):
+                frame = frame.copy()
+                for line in lines.get(idx, []):
+                    cv2.line(frame, line[0], line[1], 255, 1)
+                tif.save(frame)
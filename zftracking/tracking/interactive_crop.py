@@ -17,6 +17,19 @@ def get_radius(pts):
     return r
 
 
+# rows and columns of the wells of multi-well plates by number of wells
+PLATE_LAYOUTS = {6: (2, 3), 12: (3, 4), 24: (4, 6), 48: (6, 8), 96: (8, 12)}
+
+
+def grid_boxes(pt1, pt2, rows, cols):
+    """splits the rectangle between two corner points into rows x cols boxes, row by row"""
+    x_grid_size = int((pt2[0] - pt1[0]) / cols)
+    y_grid_size = int((pt2[1] - pt1[1]) / rows)
+    return [[(pt1[0] + j * x_grid_size, pt1[1] + i * y_grid_size),
+             (pt1[0] + (j + 1) * x_grid_size, pt1[1] + (i + 1) * y_grid_size)]
+            for i in range(rows) for j in range(cols)]
+
+
 class Image:
     """class to crop and select mask regions for wells"""
 
@@ -35,6 +48,8 @@ class Image:
         self.prev_mask = prev_mask
         self.xy = []
         self.dxy = []
+        # rows and columns of the plate for auto_crop
+        self.grid = PLATE_LAYOUTS[24]
 
     def click2rect(self, event, x, y, flags, param):
         """creates rectangle from mouse input"""
@@ -72,6 +87,15 @@ class Image:
             # show the image
             cv2.imshow("select crop area", self.small)
 
+    def draw_grid(self, pt2):
+        """draws the wells of the plate and the rectangle around them"""
+        for box in grid_boxes(self.refPt[0], pt2, *self.grid):
+            cv2.rectangle(self.small, box[0], box[1], (255, 0, 0), 1)
+        cv2.rectangle(self.small,
+                      self.refPt[0],
+                      pt2,
+                      (0, 255, 0), 2)
+
     def click2grid(self, event, x, y, flags, param):
         """creates rectangle from mouse input"""
         # gets mouse events from crop method
@@ -86,23 +110,7 @@ class Image:
             # first clear the  image
             self.small = self.small_clone.copy()
             # draw the grid on the image
-            x_size = x - self.refPt[0][0]
-            x_grid_size = int(x_size / 6)
-            y_size = y - self.refPt[0][1]
-            y_grid_size = int(y_size / 4)
-            box = [list(self.refPt[0]), [0, 0]]
-            for i in range(4):
-                for j in range(6):
-                    box[1][0] = box[0][0] + x_grid_size
-                    box[1][1] = box[0][1] + y_grid_size
-                    cv2.rectangle(self.small, tuple(box[0]), tuple(box[1]), (255, 0, 0), 1)
-                    box[0][0] = box[1][0]
-                box[0][0] = self.refPt[0][0]
-                box[0][1] += y_grid_size
-            cv2.rectangle(self.small,
-                          self.refPt[0],
-                          (x, y),
-                          (0, 255, 0), 2)
+            self.draw_grid((x, y))
             # show the image
             cv2.imshow("select crop area", self.small)
         elif event == cv2.EVENT_LBUTTONUP:
@@ -114,23 +122,7 @@ class Image:
             # clear the image
             self.small = self.small_clone.copy()
             # draw the grid on the image
-            x_size = x - self.refPt[0][0]
-            x_grid_size = int(x_size / 6)
-            y_size = y - self.refPt[0][1]
-            y_grid_size = int(y_size / 4)
-            box = [list(self.refPt[0]), [0, 0]]
-            for i in range(4):
-                for j in range(6):
-                    box[1][0] = box[0][0] + x_grid_size
-                    box[1][1] = box[0][1] + y_grid_size
-                    cv2.rectangle(self.small, tuple(box[0]), tuple(box[1]), (255, 0, 0), 1)
-                    box[0][0] = box[1][0]
-                box[0][0] = self.refPt[0][0]
-                box[0][1] += y_grid_size
-            cv2.rectangle(self.small,
-                          self.refPt[0],
-                          self.refPt[1],
-                          (0, 255, 0), 2)
+            self.draw_grid(self.refPt[1])
             # show the image
             cv2.imshow("select crop area", self.small)
 
@@ -411,8 +403,10 @@ class Image:
             cv2.destroyAllWindows()
             cv2.waitKey(1) & 0xFF
 
-    def auto_crop(self):
-        """lets the user create a rectangle around all wells to be tracked"""
+    def auto_crop(self, wells=24):
+        """lets the user create a rectangle around all wells to be tracked,
+        the rectangle is split into the wells of a plate with 6, 12, 24, 48 or 96 wells"""
+        self.grid = PLATE_LAYOUTS[wells]
         # initiate a window
         cv2.namedWindow("select crop area")
 
@@ -440,22 +434,8 @@ class Image:
             # close all windows and return the coordinates
             cv2.destroyAllWindows()
             cv2.waitKey(1) & 0xFF
-            crops = []
-            x_size = self.refPt[1][0] - self.refPt[0][0]
-            x_grid_size = int(x_size / 6)
-            y_size = self.refPt[1][1] - self.refPt[0][1]
-            y_grid_size = int(y_size / 4)
-            box = [list(self.refPt[0]), [0, 0]]
-            for i in range(4):
-                for j in range(6):
-                    box[1][0] = box[0][0] + x_grid_size
-                    box[1][1] = box[0][1] + y_grid_size
-                    crops.append(self.get_crop_coords(box))
-                    box[0][0] = box[1][0]
-                box[0][0] = self.refPt[0][0]
-                box[0][1] += y_grid_size
-
-            return crops
+            # one crop per well, row by row
+            return [self.get_crop_coords(box) for box in grid_boxes(self.refPt[0], self.refPt[1], *self.grid)]
         else:
             cv2.destroyAllWindows()
             cv2.waitKey(1) & 0xFF
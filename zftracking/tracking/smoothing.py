@@ -0,0 +1,77 @@
+"""smoothing of track coordinates, every filter works on the n x 2 coordinate array of a whole track"""
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+def windows(coords, window):
+    """returns a view with all windows of window consecutive points, without copying the coordinates"""
+    coords = np.ascontiguousarray(coords)
+    return as_strided(coords, (len(coords) - window + 1, window, coords.shape[1]),
+                      (coords.strides[0], coords.strides[0], coords.strides[1]), writeable=False)
+
+
+def adaptive(coords, window=10, min_distance=10, median=False):
+    """smooths the track dynamically depending on the distance traveled within the window
+
+    the track is split into blocks of window points, a block in which the fish moved less than
+    min_distance is replaced by its mean or median point, the last block is always replaced"""
+    coords = np.asarray(coords)
+    n = len(coords)
+    if n == 0:
+        return coords.reshape(0, 2)
+    starts = np.arange(0, n, window)
+    full = len(starts) - 1
+    summarize = np.ones(len(starts), bool)
+    if full > 0:
+        # the last step of every block is left out like in analyze_tracks.track_totals, see there
+        steps = np.hypot(*np.diff(coords[:full * window + 1], axis=0).T)
+        summarize[:-1] = steps.reshape(full, window)[:, :window - 2].sum(axis=1) < min_distance
+    if median:
+        values = np.empty((len(starts), 2))
+        values[:-1] = np.median(coords[:full * window].reshape(full, window, 2), axis=1)
+        values[-1] = np.median(coords[starts[-1]:], axis=0)
+    else:
+        values = np.add.reduceat(coords, starts, axis=0) / np.diff(np.append(starts, n))[:, None]
+    # coordinates of the replacing points are truncated to whole pixels
+    smoothed = coords.copy()
+    smoothed[starts[summarize]] = np.trunc(values[summarize])
+    # only the first point of a replaced block is kept
+    blocks = np.arange(n) // window
+    return smoothed[~summarize[blocks] | (np.arange(n) % window == 0)]
+
+
+def rolling_mean(coords, window=10):
+    """mean of every window consecutive points from cumulative sums, tracks shorter than window give one point"""
+    coords = np.asarray(coords, np.float64)
+    window = max(min(window, len(coords)), 1)
+    cumulative = np.cumsum(np.vstack((np.zeros((1, 2)), coords.reshape(-1, 2))), axis=0)
+    return (cumulative[window:] - cumulative[:-window]) / window
+
+
+def rolling_median(coords, window=10):
+    """median of every window consecutive points, tracks shorter than window give one point"""
+    coords = np.asarray(coords, np.float64).reshape(-1, 2)
+    window = max(min(window, len(coords)), 1)
+    return np.median(windows(coords, window), axis=1)
+
+
+def savgol(coords, window=11, order=2):
+    """Savitzky-Golay filter, fits a polynomial of the order to every window consecutive points,
+    even windows are increased by one, tracks shorter than window use the longest odd window that fits"""
+    coords = np.asarray(coords, np.float64).reshape(-1, 2)
+    window = min(window | 1, len(coords) - 1 + len(coords) % 2)
+    if window <= order:
+        return coords.copy()
+    half = window // 2
+    # the first row of the pseudo-inverse gives the value of the fitted polynomial at the center
+    coefficients = np.linalg.pinv(np.vander(np.arange(-half, half + 1), order + 1, increasing=True))[0]
+    return np.einsum('iwk,w->ik', windows(coords, window), coefficients)
+
+
+# smoothing filters by name
+SMOOTHERS = {'adaptive': adaptive,
+             'mean': rolling_mean,
+             'median': rolling_median,
+             'savgol': savgol}
+
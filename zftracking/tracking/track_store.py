@@ -0,0 +1,173 @@
+"""columnar storage of track points backed by numpy arrays"""
+
+import numpy as np
+
+
+def spot_score(area, distance, norm_area=80, a_weight=1):
+    """score of a spot from its area and distance to the previous point, works on arrays of spots"""
+    return (a_weight * (1 - abs(norm_area - area))) + (1 - 2 * distance)
+
+
+class Point:
+    """class to store points on tracks, keeps track of the last detected point to calculate distance"""
+    def __init__(self, coords, area, frame, prev=None, norm_area=80, a_weight=1):
+        # coordinates of the center of the detected spot
+        self.coords = coords
+        # area of the detected spot
+        self.area = area
+        # standard area and weight of the area for score calculation
+        self.norm_area = norm_area
+        self.a_weight = a_weight
+        # frame in video
+        self.frame = frame
+        # if point is first on track, skip distance calculation
+        if not prev:
+            self.score = None
+            self.distance = None
+        else:
+            x_dist = self.coords[0] - prev.coords[0]
+            y_dist = self.coords[1] - prev.coords[1]
+            self.distance = np.sqrt(x_dist**2 + y_dist**2)
+            # score is calculated from area of spot and distance to previous point
+            self.score = spot_score(self.area, self.distance, self.norm_area, self.a_weight)
+
+    # functions to make sorting of spots by score possible
+    def __repr__(self):
+        return "Point at %i:%i" % self.coords
+
+    def __lt__(self, other):
+        return self.score < other.score
+
+    def __le__(self, other):
+        return self.score <= other.score
+
+    def __gt__(self, other):
+        return self.score > other.score
+
+    def __ge__(self, other):
+        return self.score >= other.score
+
+    def __eq__(self, other):
+        return self.score == other.score
+
+    def __ne__(self, other):
+        return self.score != other.score
+
+
+class TrackStore:
+    """stores track points as one numpy array per field instead of one Point object per point,
+    iterating over the store still yields Point objects for code working on points"""
+    # field name and dtype of the columns
+    fields = (('frame', np.int64),
+              ('x', np.int32),
+              ('y', np.int32),
+              ('area', np.float64),
+              ('score', np.float64),
+              ('distance', np.float64),
+              ('track', np.int32))
+
+    def __init__(self, capacity=1024, **columns):
+        if columns:
+            # wrap existing arrays without copying them
+            self.size = len(columns['frame'])
+            self.columns = {}
+            for name, dtype in self.fields:
+                column = columns.get(name)
+                if column is None:
+                    column = np.zeros(self.size, dtype)
+                self.columns[name] = np.asarray(column, dtype)
+        else:
+            self.size = 0
+            self.columns = {name: np.zeros(capacity, dtype) for name, dtype in self.fields}
+
+    def __getattr__(self, name):
+        # columns are accessible as attributes, e.g. store.frame
+        columns = self.__dict__.get('columns')
+        if columns is not None and name in columns:
+            return columns[name][:self.size]
+        raise AttributeError(name)
+
+    def __getstate__(self):
+        # only the filled part of the columns is pickled
+        return {'size': self.size, 'columns': {name: self.columns[name][:self.size] for name in self.columns}}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for idx in range(self.size):
+            yield self.point(idx)
+
+    def __getitem__(self, idx):
+        """a single index returns a Point, slices and masks return a TrackStore,
+        slices share the memory of this store"""
+        if isinstance(idx, (int, np.integer)):
+            if idx < 0:
+                idx += self.size
+            if not 0 <= idx < self.size:
+                raise IndexError("track point index out of range")
+            return self.point(idx)
+        return TrackStore(**{name: self.columns[name][:self.size][idx] for name in self.columns})
+
+    def point(self, idx):
+        """returns the point at the index as Point object"""
+        pt = Point((int(self.columns['x'][idx]), int(self.columns['y'][idx])),
+                   float(self.columns['area'][idx]),
+                   int(self.columns['frame'][idx]))
+        if not np.isnan(self.columns['score'][idx]):
+            pt.score = float(self.columns['score'][idx])
+            pt.distance = float(self.columns['distance'][idx])
+        return pt
+
+    def append(self, frame, x, y, area, score=None, distance=None, track=0):
+        """adds a point at the end, the columns grow by doubling"""
+        if self.size == len(self.columns['frame']):
+            for name in self.columns:
+                column = self.columns[name]
+                grown = np.zeros(max(2 * len(column), 1), column.dtype)
+                grown[:self.size] = column[:self.size]
+                self.columns[name] = grown
+        idx = self.size
+        self.columns['frame'][idx] = frame
+        self.columns['x'][idx] = x
+        self.columns['y'][idx] = y
+        self.columns['area'][idx] = area
+        # the first point of a track has no score and distance
+        self.columns['score'][idx] = np.nan if score is None else score
+        self.columns['distance'][idx] = np.nan if distance is None else distance
+        self.columns['track'][idx] = track
+        self.size += 1
+
+    def append_point(self, pt, track=0):
+        """adds a Point object at the end"""
+        self.append(pt.frame, pt.coords[0], pt.coords[1], pt.area, pt.score, pt.distance, track)
+
+    @property
+    def coords(self):
+        """n x 2 array of the x and y coordinates"""
+        return np.column_stack((self.x, self.y))
+
+    def sort(self):
+        """returns a copy sorted by frame"""
+        return self[np.argsort(self.frame, kind='stable')]
+
+
+def split_ranges(frames, gap=25, min_length=10):
+    """splits a sorted array of frame numbers where more than gap frames are missing,
+    returns the start and end index of every part with at least min_length points as n x 2 array"""
+    # a part starts at the first point and after every gap
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(frames) > gap) + 1, [len(frames)]))
+    ranges = np.column_stack((bounds[:-1], bounds[1:]))
+    return ranges[ranges[:, 1] - ranges[:, 0] >= min_length]
+
+
+def concatenate(stores):
+    """joins track stores into a new store"""
+    stores = [store for store in stores if len(store) > 0]
+    if not stores:
+        return TrackStore()
+    return TrackStore(**{name: np.concatenate([getattr(store, name) for store in stores])
+                         for name, dtype in TrackStore.fields})
@@ -0,0 +1,136 @@
+"""tracking of single wells of multi-well plates, shared by the larva and the well-plate workflow"""
+
+import errno
+import os
+from datetime import datetime
+
+from zftracking.external.runffmpeg import Ffmpeg
+from zftracking.tracking.analyze_tracks import Analysis
+from zftracking.tracking.cv_tracking import Plate
+from zftracking.tracking.cv_tracking import Video
+from zftracking.tracking.cv_tracking import crop_box
+from zftracking.tracking.interactive_crop import Image
+from zftracking.tracking.zones import Zones
+
+
+def silent_remove(filename):
+    """removes file without error on non existing file"""
+    try:
+        os.remove(filename)
+    except OSError as err:
+        if err.errno != errno.ENOENT:  # errno.ENOENT = no such file or directory
+            raise  # re-raise exception if a different error occurred
+
+
+def crop_and_mask(infile, temp_dir, thumb, prev_crop=False, prev_mask=False):
+    """initiates the interactive cropping and masking of the video"""
+    image = Image(thumb, prev_crop=prev_crop)
+    crop = image.crop()
+    silent_remove(os.path.join(temp_dir, "crop.tiff"))
+    ffmpeg = Ffmpeg(infile, os.path.join(temp_dir, "crop.tiff"))
+    ffmpeg.pix_fmt = "gray8"
+    ffmpeg.vframes = "1"
+    ffmpeg.seek_keyframe(150)
+    ffmpeg.filter = "crop=" + crop
+    ffmpeg.run()
+    image = Image(os.path.join(temp_dir, "crop.tiff"), prev_mask=prev_mask)
+    mask = image.mask()
+    return crop, mask
+
+
+def crop_thumbnails(infile, temp_dirs, crops):
+    """writes a thumbnail of every well to its temporary folder from a single ffmpeg process"""
+    ffmpeg = Ffmpeg(infile)
+    ffmpeg.pix_fmt = "gray8"
+    ffmpeg.vframes = "1"
+    ffmpeg.seek_keyframe(150)
+    for temp_dir, crop in zip(temp_dirs, crops):
+        silent_remove(os.path.join(temp_dir, "crop.tiff"))
+        ffmpeg.add_output(os.path.join(temp_dir, "crop.tiff"), "crop=" + crop)
+    ffmpeg.run()
+
+
+def save_well(temp_dir, crop, mask, start_frame, end_frame):
+    """writes the crop, inner circle and frame range of a well to its temporary folder,
+    so the well can be tracked again with only_tracking"""
+    with open(os.path.join(temp_dir, "well.txt"), 'w') as out:
+        out.write('\t'.join(str(v) for v in (crop, mask[0][0], mask[0][1], mask[1], start_frame, end_frame)))
+        out.write('\n')
+
+
+def load_well(temp_dir):
+    """reads the crop, inner circle and frame range of a well written by save_well,
+    an open end of the range is None"""
+    with open(os.path.join(temp_dir, "well.txt")) as f:
+        crop, x, y, radius, start_frame, end_frame = f.read().split()
+    start_frame, end_frame = (None if v == 'None' else int(v) for v in (start_frame, end_frame))
+    return crop, ((int(x), int(y)), int(radius)), start_frame, end_frame
+
+
+def check_plate_options(parser, args):
+    """rejects options of the larva and well-plate scripts that the chosen way of tracking would ignore"""
+    if args.plate_wide:
+        # the plate wide segmentation searches every frame of the whole plate against a static background
+        ignored = [flag for flag, value in (("--gate", args.gate), ("--motion", args.motion),
+                                            ("--pyramid", args.pyramid > 1), ("--rolling", args.rolling))
+                   if value]
+        if ignored:
+            parser.error("--plate_wide cannot be combined with " + ", ".join(ignored))
+    if args.checkpoint and (args.single_decode or args.plate_wide):
+        # the wells of a plate decoded once are tracked together in memory, without checkpoints
+        parser.error("--checkpoint cannot be combined with --single_decode or --plate_wide")
+    if args.checkpoint and not args.rolling:
+        parser.error("--checkpoint needs --rolling")
+
+
+def print_report(name, report):
+    """prints the counters of the tracking of a well or plate, if there are any"""
+    if report:
+        print(name + ": " + report)
+
+
+def track_plate(args, infile, crops, start_frame, end_frame):
+    """decodes the plate video once, slices every frame into the wells and returns the tracks of every well"""
+    plate = Plate(infile, crops, prefetch=args.prefetch, start=start_frame, end=end_frame)
+    tracks = plate.track(median=args.median, components=args.components, wide=args.plate_wide,
+                         gate=args.gate, motion=args.motion, pyramid=args.pyramid, rolling=args.rolling)
+    print_report("plate", plate.report())
+    for i, vid in enumerate(plate.videos):
+        print_report("well " + str(i), vid.report())
+    return tracks
+
+
+def track_well(params):
+    """tracks the whole well once and analyzes the tracks split into the inner circle and the outer region,
+    runs in a worker process and returns the statistics and the wall time and counters of the tracking
+
+    params holds the parsed arguments of the script, the video, the crop and inner circle of the well,
+    its temporary folder, the output folder, its number, the range of frames
+    and its tracks if the plate was already tracked at once, None otherwise"""
+    args, infile, crop, mask, temp_dir, out_dir, i, start_frame, end_frame, tracks = params
+    start = datetime.now()
+    report = ""
+    if tracks is None:
+        # ffmpeg crops the well while decoding, no intermediate video is written
+        vid = Video(infile, big=args.big, median=args.median, crop=crop,
+                    prefetch=args.prefetch, start=start_frame, end=end_frame, components=args.components,
+                    gate=args.gate, motion=args.motion, pyramid=args.pyramid, rolling=args.rolling,
+                    checkpoint=os.path.join(temp_dir, "checkpoint.pkl") if args.checkpoint else None,
+                    checkpoint_every=args.checkpoint)
+        tracks = vid.track()
+        report = vid.report()
+    # the inner circle is zone 1, the rest of the well zone 0
+    rows, cols = crop_box(crop)
+    zones = Zones((rows.stop - rows.start, cols.stop - cols.start))
+    zones.add_circle(mask[0], mask[1])
+    outer_tracks, inner_tracks = zones.split_tracks(tracks)
+    analysis = Analysis(outer_tracks, inner_tracks, smoothing=args.smoothing, window=args.window)
+    stats = analysis.stats()
+    if args.save_track_image:
+        analysis.save_track_image(temp_dir, out_dir, i)
+    if args.save_track:
+        # save track points to file
+        analysis.save_track(out_dir, i)
+    # the wall time of every well shows how evenly the wells keep the processes busy
+    report = "done in " + str(datetime.now() - start) + (", " + report if report else "")
+    return stats, report
@@ -0,0 +1,72 @@
+"""zones of an arena rasterized once into a label image, track points are assigned to zones by array indexing"""
+
+import numpy as np
+
+import cv2
+
+
+class Zones:
+    """label image of the zones of an arena, every zone is drawn over the earlier ones,
+    pixels outside of all drawn zones belong to zone 0"""
+    def __init__(self, shape):
+        self.labels = np.zeros(shape, np.uint8)
+        # number of zones including zone 0
+        self.count = 1
+
+    def add(self, region):
+        """adds the pixels of a boolean image as new zone and returns its number"""
+        self.labels[region] = self.count
+        self.count += 1
+        return self.count - 1
+
+    def add_circle(self, center, radius):
+        """adds the pixels with a distance to center of at most radius as new zone"""
+        yy, xx = np.indices(self.labels.shape)
+        return self.add(np.sqrt((xx - center[0]) ** 2 + (yy - center[1]) ** 2) <= radius)
+
+    def add_polygon(self, pts):
+        """adds the pixels inside of the polygon and on its outline as new zone"""
+        region = np.zeros(self.labels.shape, np.uint8)
+        cv2.fillPoly(region, [np.array(pts, np.int32)], 1)
+        return self.add(region > 0)
+
+    def add_line(self, pt1, pt2):
+        """adds the pixels above the line through both points as new zone, pixels on the line stay below,
+        for a vertical line the pixels left of it are added"""
+        yy, xx = np.indices(self.labels.shape)
+        if pt1[0] == pt2[0]:
+            return self.add(xx < pt1[0])
+        slope = (pt2[1] - pt1[1]) / (pt2[0] - pt1[0])
+        return self.add(yy < pt1[1] + slope * (xx - pt1[0]))
+
+    def classify(self, pts):
+        """returns the zone of every point of a track store"""
+        height, width = self.labels.shape
+        return self.labels[np.clip(pts.y, 0, height - 1), np.clip(pts.x, 0, width - 1)]
+
+    def runs(self, pts):
+        """run-length encodes the zones along a track store,
+        returns the zone, start and end index of every run of points in the same zone as n x 3 array"""
+        zones = self.classify(pts)
+        if len(zones) == 0:
+            return np.zeros((0, 3), np.int64)
+        # a run starts at the first point and at every change of the zone
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(zones)) + 1, [len(zones)]))
+        return np.column_stack((zones[bounds[:-1]], bounds[:-1], bounds[1:]))
+
+    def split(self, pts):
+        """splits a track store at every change of the zone,
+        returns a list for every zone with views on the track store for its runs"""
+        segments = [[] for _ in range(self.count)]
+        for zone, start, end in self.runs(pts):
+            segments[zone].append(pts[start:end])
+        return segments
+
+    def split_tracks(self, tracks):
+        """splits every track of a list at every change of the zone,
+        returns a list for every zone with the views of all tracks for its runs"""
+        segments = [[] for _ in range(self.count)]
+        for track in tracks:
+            for zone, runs in enumerate(self.split(track)):
+                segments[zone] += runs
+        return segments